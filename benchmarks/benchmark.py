@@ -0,0 +1,231 @@
+"""Benchmarks of the hot paths of the server over synthetic databases, reported as JSON.
+
+Run from the root of the repository with:
+
+    uv run python -m benchmarks.benchmark --tables 20 --rows 10000 --columns 8 --output results.json
+"""
+
+import argparse
+from collections.abc import Awaitable, Callable
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import string
+import sys
+import tempfile
+import time
+from typing import Any
+
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from mcp.shared.memory import create_connected_server_and_client_session
+
+from mcp_sqlite.server import (
+    RESULT_FORMATS,
+    CatalogCache,
+    ConnectionPool,
+    RootMetadata,
+    ServerSettings,
+    execute,
+    get_catalog,
+    get_result_format,
+    mcp_sqlite_server,
+)
+
+
+def create_synthetic_database(
+    path: str, tables: int = 10, rows: int = 1000, columns: int = 8, text_width: int = 16, seed: int = 0
+) -> None:
+    """Create tables table_0 to table_{tables - 1}, each with an integer primary key and `columns` more columns cycling
+    through integers, reals, and random text `text_width` characters wide, filled with `rows` reproducible rows.
+    """
+    rng = random.Random(seed)
+    column_types = ["integer", "real", "text"]
+
+    def value(index: int) -> Any:
+        if index % 3 == 0:
+            return rng.randrange(1_000_000)
+        elif index % 3 == 1:
+            return rng.random() * 1000
+        return "".join(rng.choices(string.ascii_letters, k=text_width))
+
+    with sqlite3.connect(path) as sqlite_connection:
+        for table_index in range(tables):
+            column_definitions = ", ".join(f"col_{index} {column_types[index % 3]}" for index in range(columns))
+            sqlite_connection.execute(
+                f"create table table_{table_index} (id integer primary key, {column_definitions})"
+            )
+            sqlite_connection.executemany(
+                f"insert into table_{table_index} values (?, {', '.join('?' * columns)})",
+                ([row_index, *(value(index) for index in range(columns))] for row_index in range(rows)),
+            )
+    sqlite_connection.close()
+
+
+def summarize(durations: list[float], items: int = 1) -> dict[str, float]:
+    """Summarize the durations in seconds of repeated runs that each process `items` items."""
+    ordered = sorted(durations)
+    return {
+        "runs": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "items_per_second": items / statistics.median(ordered) if statistics.median(ordered) else 0,
+    }
+
+
+async def measure(function: Callable[[], Awaitable[Any]], repeat: int, items: int = 1) -> dict[str, float]:
+    # Warm up caches and connections before timing
+    await function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await function()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+async def benchmark_catalog(pool: ConnectionPool, repeat: int) -> dict[str, Any]:
+    catalog_cache = CatalogCache(pool, RootMetadata())
+    return {
+        "build": await measure(lambda: get_catalog(pool, RootMetadata()), repeat),
+        "cached": await measure(catalog_cache.get, repeat),
+    }
+
+
+async def benchmark_queries(pool: ConnectionPool, repeat: int, query_rows: int, concurrency: int) -> dict[str, Any]:
+    sql = f"select * from table_0 limit {query_rows}"
+    point_sql = "select * from table_0 where id = :id"
+
+    async def concurrent_queries():
+        async with anyio.create_task_group() as task_group:
+            for task_index in range(concurrency):
+                task_group.start_soon(execute, pool, point_sql, {"id": task_index})
+
+    return {
+        "scan": await measure(lambda: execute(pool, sql, max_rows=query_rows, max_bytes=0), repeat, query_rows),
+        "point_lookup": await measure(lambda: execute(pool, point_sql, {"id": 1}), repeat),
+        "concurrent_point_lookups": await measure(concurrent_queries, repeat, concurrency),
+    }
+
+
+async def benchmark_serialization(pool: ConnectionPool, repeat: int, query_rows: int) -> dict[str, Any]:
+    async with pool.reader() as sqlite_connection:
+        cursor = await sqlite_connection.execute(f"select * from table_0 limit {query_rows}")
+        columns = [column[0] for column in cursor.description]
+        rows = list(await cursor.fetchall())
+    results = {}
+    for format_name in RESULT_FORMATS:
+        result_format = get_result_format(format_name)
+
+        async def serialize(result_format=result_format):
+            return (
+                result_format.header(columns)
+                + result_format.separator.join(result_format.format_rows(rows))
+                + result_format.footer()
+            )
+
+        text = await serialize()
+        results[format_name] = await measure(serialize, repeat, len(rows)) | {"bytes": len(text.encode())}
+    return results
+
+
+async def benchmark_round_trip(sqlite_file: str, repeat: int, query_rows: int) -> dict[str, Any]:
+    settings = ServerSettings(max_rows=query_rows, max_bytes=0, result_cache_size=0)
+    async with mcp_sqlite_server(sqlite_file, settings=settings) as server:
+        async with create_connected_server_and_client_session(server) as session:
+            sql = f"select * from table_0 limit {query_rows}"
+            return {
+                "list_tools": await measure(session.list_tools, repeat),
+                "get_catalog": await measure(lambda: session.call_tool("sqlite_get_catalog", {}), repeat),
+                "execute": await measure(
+                    lambda: session.call_tool("sqlite_execute", {"sql": sql, "format": "json"}), repeat, query_rows
+                ),
+            }
+
+
+async def benchmark_startup(sqlite_file: str, repeat: int) -> dict[str, Any]:
+    """Time from spawning a server process to the responses to initialize and to the first catalog call."""
+    server_parameters = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(os.path.dirname(__file__), "..", "mcp_sqlite", "server.py"), sqlite_file],
+    )
+    initialize_durations, catalog_durations = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        async with stdio_client(server_parameters) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                initialize_durations.append(time.perf_counter() - start)
+                await session.call_tool("sqlite_get_catalog", {})
+                catalog_durations.append(time.perf_counter() - start)
+    return {"initialize": summarize(initialize_durations), "first_catalog": summarize(catalog_durations)}
+
+
+async def run_benchmarks(args: argparse.Namespace) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        sqlite_file = os.path.join(temporary_directory, "benchmark.db")
+        start = time.perf_counter()
+        create_synthetic_database(
+            sqlite_file, tables=args.tables, rows=args.rows, columns=args.columns, text_width=args.text_width
+        )
+        logging.info(f"Generated the synthetic database in {time.perf_counter() - start:.2f}s")
+        results = {}
+        async with ConnectionPool(sqlite_file) as pool:
+            results["catalog"] = await benchmark_catalog(pool, args.repeat)
+            results["queries"] = await benchmark_queries(pool, args.repeat, args.query_rows, args.concurrency)
+            results["serialization"] = await benchmark_serialization(pool, args.repeat, args.query_rows)
+        results["round_trip"] = await benchmark_round_trip(sqlite_file, args.repeat, args.query_rows)
+        results["startup"] = await benchmark_startup(sqlite_file, args.startup_repeat)
+    return {
+        "environment": {
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mcp-sqlite over a synthetic database.")
+    parser.add_argument("--tables", help="Number of tables to generate. Defaults to 10.", type=int, default=10)
+    parser.add_argument("--rows", help="Number of rows in each table. Defaults to 10000.", type=int, default=10_000)
+    parser.add_argument(
+        "--columns", help="Number of columns besides id in each table. Defaults to 8.", type=int, default=8
+    )
+    parser.add_argument("--text-width", help="Characters in each text value. Defaults to 16.", type=int, default=16)
+    parser.add_argument(
+        "--query-rows", help="Rows read by each scanning query. Defaults to 1000.", type=int, default=1000
+    )
+    parser.add_argument(
+        "--concurrency", help="Queries run at once by the concurrent benchmark. Defaults to 8.", type=int, default=8
+    )
+    parser.add_argument("--repeat", help="Timed runs of each benchmark. Defaults to 20.", type=int, default=20)
+    parser.add_argument(
+        "--startup-repeat", help="Server processes started to time startup. Defaults to 5.", type=int, default=5
+    )
+    parser.add_argument("-o", "--output", help="File to write the JSON results to. Defaults to standard output.")
+    parser.add_argument("-v", "--verbose", help="Log progress.", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    # Keep the log of every MCP request out of the progress log
+    logging.getLogger("mcp").setLevel(logging.WARNING)
+    results = anyio.run(run_benchmarks, args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
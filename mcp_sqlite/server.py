@@ -1,21 +1,53 @@
+# ruff: noqa: E402 - the start time is taken before the other imports
+import time
+
+# Taken before importing anything else, so that -v can report how long the server took to start
+STARTED_AT = time.perf_counter()
+
+from abc import ABC, abstractmethod
 import argparse
+import bisect
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, suppress
+import glob
+import csv
+from datetime import datetime, timezone
+import difflib
+import hashlib
 import html
+import io
+import json
 import logging
-from pathlib import PurePath
+import math
+import os
+import random
+from pathlib import Path, PurePath
 import re
+import secrets
+import signal
+import sqlite3
+import sys
+import tempfile
+from typing import Any
 
 import aiosqlite
 import anyio
+import anyio.to_thread
+from anyio.abc import TaskGroup
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import TextContent, Tool
 from pydantic import BaseModel, Field
-import yaml
 
 
 class TableMetadata(BaseModel):
     hidden: bool = Field(False, exclude=True)
     columns: dict[str, str] = {}
+    # Fraction of the rows that sampled queries read, from `sample_table` if given and through rowid ranges otherwise
+    sample_fraction: float | None = Field(None, gt=0, le=1)
+    # Table in the same database holding a uniform random sample of `sample_fraction` of the rows of this one
+    sample_table: str | None = None
     model_config = {
         "extra": "allow",
     }
@@ -27,123 +59,2511 @@ class QueryMetadata(BaseModel):
     description: str | None = None
     write: bool | None = None
     hide_sql: bool = Field(False, exclude=True)
+    # Serve calls from a precomputed copy of the results, recomputed every `refresh_seconds` if given and otherwise on
+    # the first call after the data changed
+    materialized: bool = Field(False, exclude=True)
+    refresh_seconds: float | None = Field(None, gt=0, exclude=True)
+    model_config = {
+        "extra": "allow",
+    }
+
+
+class DatabaseMetadata(BaseModel):
+    title: str | None = None
+    tables: dict[str, TableMetadata] = {}
+    queries: dict[str, QueryMetadata] = {}
+    model_config = {
+        "extra": "allow",
+    }
+
+
+class RootMetadata(BaseModel):
+    databases: dict[str, DatabaseMetadata] = {}
     model_config = {
         "extra": "allow",
     }
 
 
-class DatabaseMetadata(BaseModel):
-    title: str | None = None
-    tables: dict[str, TableMetadata] = {}
-    queries: dict[str, QueryMetadata] = {}
-    model_config = {
-        "extra": "allow",
-    }
+class ServerSettings(BaseModel):
+    # Number of read-only connections kept open for concurrent tool calls
+    pool_size: int = Field(default=4, ge=1)
+    # Maximum number of reads and of writes waiting for a connection before new ones are rejected, 0 meaning unlimited
+    max_queued: int = Field(default=64, ge=0)
+    # Maximum number of rows and UTF-8 bytes of rendered output returned by one query, 0 meaning unlimited
+    max_rows: int = Field(default=1000, ge=0)
+    max_bytes: int = Field(default=1_000_000, ge=0)
+    # Seconds and SQLite virtual machine steps after which a query is interrupted, 0 meaning unlimited
+    query_timeout: float = Field(default=30, ge=0)
+    max_steps: int = Field(default=0, ge=0)
+    # Maximum number of paginated results kept open at once, and seconds an unused one is kept open
+    max_open_pages: int = Field(default=8, ge=1)
+    page_ttl: float = Field(default=300, gt=0)
+    # Serialization of query results unless a tool call asks for another one, one of RESULT_FORMATS
+    result_format: str = "html"
+    # Maximum number of cached query results (0 disabling the cache), their total size, and seconds they stay valid
+    result_cache_size: int = Field(default=128, ge=0)
+    result_cache_bytes: int = Field(default=16_000_000, ge=0)
+    result_cache_ttl: float = Field(default=60, gt=0)
+    # Offer an enriched catalog with column types, keys, indexes, row estimates, and sampled column statistics
+    enriched_catalog: bool = False
+    # Run ANALYZE in the background at startup so that the enriched catalog can estimate row counts
+    analyze: bool = False
+    # Number of rows at the start of each table that column statistics are computed over, 0 disabling them
+    stats_sample_rows: int = Field(default=10_000, ge=0)
+    # Seconds a tool call's query must take to go in the slow query log along with its query plan, 0 disabling the log
+    slow_query_seconds: float = Field(default=1, ge=0)
+    # File that a snapshot of the metrics is written to every `metrics_interval` seconds, in the Prometheus text format
+    # if it ends in .prom or .txt and as JSON otherwise
+    metrics_file: str | None = None
+    metrics_interval: float = Field(default=60, gt=0)
+    # Tables with at least this many rows are flagged when a query plan scans all of them
+    large_table_rows: int = Field(default=10_000, ge=0)
+    # Append a note to results of queries that scan a large table, and record scans of large tables in the metrics
+    scan_warnings: bool = False
+    record_scans: bool = False
+    # Bytes of each file that read-only connections access through memory-mapped I/O, and KiB of page cache of each
+    # read-only connection, 0 leaving SQLite's defaults
+    mmap_size: int = Field(default=0, ge=0)
+    cache_size: int = Field(default=0, ge=0)
+    # Keep temporary tables and indices of read-only connections in memory, and reject any writes through them at all
+    temp_store_memory: bool = False
+    query_only: bool = False
+    # Open read-only connections to files that never change with immutable=1, skipping locking and change detection
+    immutable: bool = False
+    # Read the files once in the background at startup so that their pages are cached by the operating system
+    warm_up: bool = False
+    # Parameter sets written by one bulk write before committing and starting the next transaction, 0 meaning that the
+    # whole bulk write is one transaction
+    write_chunk_size: int = Field(default=0, ge=0)
+    # Switch the files written to to write-ahead logging, so that writes don't block reads and commit faster
+    wal: bool = False
+    # Milliseconds single-row writes wait to be committed together with concurrent ones, 0 committing each on its own
+    group_commit_ms: float = Field(default=0, ge=0)
+    # Directory that sqlite_export streams full query results to, the tool being left out if not set
+    export_dir: str | None = None
+
+    def reader_pragmas(self) -> list[str]:
+        pragmas = []
+        if self.mmap_size:
+            pragmas.append(f"mmap_size = {self.mmap_size}")
+        if self.cache_size:
+            # Negative values are in KiB rather than in pages
+            pragmas.append(f"cache_size = -{self.cache_size}")
+        if self.temp_store_memory:
+            pragmas.append("temp_store = memory")
+        if self.query_only:
+            pragmas.append("query_only = on")
+        return pragmas
+
+    def writer_pragmas(self) -> list[str]:
+        if self.wal:
+            # In WAL mode commits only need to sync the log at checkpoints to survive a crash of the process
+            return ["journal_mode = wal", "synchronous = normal"]
+        return []
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Pragmas that apply to one database at a time, rather than to the whole connection
+PER_DATABASE_PRAGMAS = {"cache_size", "mmap_size", "journal_mode", "synchronous"}
+
+
+# Pragmas that only read despite taking an argument, like the table name that pragma_table_info is called with
+READ_ONLY_PRAGMAS = {
+    "table_info",
+    "table_xinfo",
+    "table_list",
+    "index_info",
+    "index_xinfo",
+    "index_list",
+    "foreign_key_list",
+    "foreign_key_check",
+    "integrity_check",
+    "quick_check",
+}
+
+
+def reader_authorizer(action: int, argument1: str | None, argument2: str | None, database: str | None, _) -> int:
+    """Deny statements that would change a pooled read-only connection for the calls that reuse it after this one:
+    attaching or detaching databases, setting pragmas, and creating objects in the temp database.
+    """
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA:
+        return (
+            sqlite3.SQLITE_DENY
+            if argument2 is not None and (argument1 or "").lower() not in READ_ONLY_PRAGMAS
+            else sqlite3.SQLITE_OK
+        )
+    if database == "temp" and action != sqlite3.SQLITE_READ:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+class PoolBusyError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Reusable read-only connections plus a single lazily-opened writer connection to one SQLite file, and to any files
+    attached under their stems. Beyond `max_queued` reads or writes waiting for their turn, PoolBusyError is raised.
+    """
+
+    def __init__(
+        self,
+        sqlite_file: str,
+        size: int = 4,
+        cached_statements: int = 128,
+        max_queued: int = 0,
+        attach_files: Sequence[str] = (),
+        reader_pragmas: Sequence[str] = (),
+        immutable: bool = False,
+        writer_pragmas: Sequence[str] = (),
+    ):
+        if size < 1:
+            raise ValueError(f"Connection pool size must be at least 1, got {size}.")
+        self.sqlite_file = sqlite_file
+        self.attached_files: dict[str, str] = {}
+        for attach_file in attach_files:
+            stem = PurePath(attach_file).stem
+            if stem in self.attached_files or stem in ("main", "temp", PurePath(sqlite_file).stem):
+                raise ValueError(f"Cannot attach '{attach_file}', as the database name '{stem}' is already taken.")
+            self.attached_files[stem] = attach_file
+        self.size = size
+        self.cached_statements = cached_statements
+        self.max_queued = max_queued
+        self.reader_pragmas = list(reader_pragmas)
+        self.immutable = immutable
+        self.writer_pragmas = list(writer_pragmas)
+        self.queued = {"read": 0, "write": 0}
+        self.queue_wait_seconds = {"read": 0.0, "write": 0.0}
+        self._idle_readers: list[aiosqlite.Connection] = []
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._reader_slots = anyio.Semaphore(size)
+        self._dedicated: set[aiosqlite.Connection] = set()
+        self._writer: aiosqlite.Connection | None = None
+        self._writer_lock = anyio.Lock()
+        # Called once a write has its turn, before it starts, e.g. to end read transactions that would block it
+        self.before_write: list[Callable[[], Awaitable[None]]] = []
+        self._monitor: aiosqlite.Connection | None = None
+        self._monitor_lock = anyio.Lock()
+
+    async def _connect(self, mode: str) -> aiosqlite.Connection:
+        options = f"mode={mode}&immutable=1" if mode == "ro" and self.immutable else f"mode={mode}"
+        connection = await aiosqlite.connect(
+            f"file:{self.sqlite_file}?{options}", uri=True, cached_statements=self.cached_statements
+        )
+        schemas = ["main"]
+        for stem, attach_file in self.attached_files.items():
+            schema = quote_identifier(stem)
+            try:
+                await connection.execute(f"attach database ? as {schema}", (f"file:{attach_file}?{options}",))
+                schemas.append(stem)
+            except sqlite3.OperationalError:
+                if mode == "ro":
+                    await connection.close()
+                    raise
+                # Files that can't be written to are still readable through the writer connection
+                await connection.execute(f"attach database ? as {schema}", (f"file:{attach_file}?mode=ro",))
+        for pragma in self.reader_pragmas if mode == "ro" else self.writer_pragmas:
+            if pragma.split("=")[0].strip() in PER_DATABASE_PRAGMAS:
+                for schema in schemas:
+                    await connection.execute(f"pragma {quote_identifier(schema)}.{pragma}")
+            else:
+                await connection.execute(f"pragma {pragma}")
+        if mode == "ro":
+            await connection._execute(connection._conn.set_authorizer, reader_authorizer)
+        return connection
+
+    async def warm_up(self, chunk_size: int = 1 << 20) -> None:
+        """Read every file once from start to end so that the operating system caches its pages ahead of queries."""
+        for path in [self.sqlite_file, *self.attached_files.values()]:
+            started_at = time.perf_counter()
+
+            def read_file() -> int:
+                total_bytes = 0
+                with open(path, "rb", buffering=0) as sqlite_file:
+                    while chunk := sqlite_file.read(chunk_size):
+                        total_bytes += len(chunk)
+                return total_bytes
+
+            total_bytes = await anyio.to_thread.run_sync(read_file)
+            logging.info(f"Warmed up {path} ({total_bytes} bytes) in {time.perf_counter() - started_at:.2f}s")
+
+    @asynccontextmanager
+    async def _turn(self, limiter: anyio.Semaphore | anyio.Lock, kind: str) -> AsyncIterator[None]:
+        if self.max_queued and self.queued[kind] >= self.max_queued:
+            raise PoolBusyError(f"The server is busy with {self.queued[kind]} queued {kind}s, try again shortly.")
+        self.queued[kind] += 1
+        queued_at = time.monotonic()
+        try:
+            await limiter.acquire()
+        finally:
+            self.queued[kind] -= 1
+        self.queue_wait_seconds[kind] += time.monotonic() - queued_at
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def reader_slot(self) -> AbstractAsyncContextManager[None]:
+        """Wait for a turn among the concurrent reads, for reads that run on their own dedicated connection."""
+        return self._turn(self._reader_slots, "read")
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self.reader_slot():
+            if self._idle_readers:
+                connection = self._idle_readers.pop()
+            else:
+                connection = await self._connect("ro")
+                self._all_readers.append(connection)
+            try:
+                yield connection
+            finally:
+                # Never hand out a connection stuck inside a transaction started by the previous user (e.g. BEGIN)
+                with anyio.CancelScope(shield=True):
+                    if connection.in_transaction:
+                        await connection.rollback()
+                self._idle_readers.append(connection)
+
+    async def open_dedicated(self) -> aiosqlite.Connection:
+        """Open a read-only connection outside of the pool for work that spans several tool calls."""
+        connection = await self._connect("ro")
+        self._dedicated.add(connection)
+        return connection
+
+    async def close_dedicated(self, connection: aiosqlite.Connection) -> None:
+        self._dedicated.discard(connection)
+        with anyio.CancelScope(shield=True):
+            await connection.close()
+
+    async def data_version(self) -> tuple[int, ...]:
+        """Return a stamp that changes whenever any connection, in this process or another one, commits to the files.
+        PRAGMA data_version only changes relative to the connection it runs on, so it always runs on the same one.
+        """
+        data_version = []
+        async with self._monitor_lock:
+            if self._monitor is None:
+                self._monitor = await self.open_dedicated()
+            for schema in ["main", *self.attached_files]:
+                cursor = await self._monitor.execute(f"pragma {quote_identifier(schema)}.data_version")
+                data_version += [version_row[0] for version_row in await cursor.fetchall()]
+        for path in [self.sqlite_file, *self.attached_files.values()]:
+            try:
+                data_version.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                data_version.append(0)
+        return tuple(data_version)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._turn(self._writer_lock, "write"):
+            for callback in self.before_write:
+                await callback()
+            if self._writer is None:
+                self._writer = await self._connect("rw")
+            try:
+                yield self._writer
+            except BaseException:
+                with anyio.CancelScope(shield=True):
+                    if self._writer.in_transaction:
+                        await self._writer.rollback()
+                raise
+            else:
+                if self._writer.in_transaction:
+                    await self._writer.commit()
+
+    async def close(self) -> None:
+        for connection in self._all_readers:
+            await connection.close()
+        self._all_readers.clear()
+        self._idle_readers.clear()
+        for connection in list(self._dedicated):
+            await self.close_dedicated(connection)
+        self._monitor = None
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self) -> "ConnectionPool":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+# Every column of every table in every database, with databases that have no tables included as a row of NULLs
+CATALOG_SQL = """
+select database_list.name, database_list.file, table_list.name, table_info.name
+from pragma_database_list as database_list
+left join pragma_table_list as table_list
+    on table_list.schema = database_list.name and substr(table_list.name, 1, 7) <> 'sqlite_'
+left join pragma_table_info(table_list.name, database_list.name) as table_info
+order by database_list.seq, table_list.name, table_info.cid
+"""
+
+
+async def get_catalog(pool: ConnectionPool, metadata: RootMetadata) -> RootMetadata:
+    # Copy all metadata except databases
+    catalog = RootMetadata(**{key: value for key, value in metadata if key != "databases"})
+    # Introspect every database, table, and column in a single query and a single trip to the connection's thread
+    async with pool.reader() as sqlite_connection:
+        catalog_rows = await sqlite_connection.execute_fetchall(CATALOG_SQL)
+    database = table = database_metadata = table_metadata = table_key = None
+    for database_name, database_file, table_name, column_name in catalog_rows:
+        # Rows come ordered by database and table, so each database and table is set up on its first row
+        if database_name not in catalog.databases:
+            database_stem = PurePath(database_file).stem
+            database_metadata = metadata.databases.get(database_stem)
+            # Rename from the stem to the true SQLite-internal name (usually "main")
+            database = DatabaseMetadata(
+                **({key: value for key, value in database_metadata if key != "tables"} if database_metadata else {})
+            )
+            # Set the default title for the database if not provided
+            if not database.title:
+                database.title = database_stem
+            catalog.databases[database_name] = database
+        if database is None or table_name is None:
+            continue
+        if table is None or (database_name, table_name) != table_key:
+            table_key = (database_name, table_name)
+            table_metadata = database_metadata.tables.get(table_name) if database_metadata else None
+            table = TableMetadata(
+                **({key: value for key, value in table_metadata if key != "columns"} if table_metadata else {})
+            )
+            # Omit hidden tables
+            if not table.hidden:
+                database.tables[table_name] = table
+        if not table.hidden:
+            table.columns[column_name] = table_metadata.columns.get(column_name, "") if table_metadata else ""
+    return catalog
+
+
+async def get_schema_version(pool: ConnectionPool) -> tuple[int, ...]:
+    """Return the schema version of every database in the connection, which SQLite bumps on each schema change."""
+    async with pool.reader() as sqlite_connection:
+        cursor = await sqlite_connection.execute("pragma database_list")
+        database_names = [database_row[1] for database_row in await cursor.fetchall()]
+        schema_version = []
+        for database_name in database_names:
+            cursor = await sqlite_connection.execute(f"pragma {quote_identifier(database_name)}.schema_version")
+            schema_version += [version_row[0] for version_row in await cursor.fetchall()]
+        return tuple(schema_version)
+
+
+# Declared type and key membership of every column of every table in every database
+COLUMN_DETAILS_SQL = """
+select database_list.name, table_list.name, table_list.type, table_info.name, table_info.type, table_info.pk
+from pragma_database_list as database_list
+join pragma_table_list as table_list
+    on table_list.schema = database_list.name and substr(table_list.name, 1, 7) <> 'sqlite_'
+join pragma_table_info(table_list.name, database_list.name) as table_info
+order by database_list.seq, table_list.name, table_info.cid
+"""
+
+# Foreign keys of every table in every database, one row per column of each key
+FOREIGN_KEYS_SQL = """
+select database_list.name, table_list.name, foreign_key_list.id, foreign_key_list."table", foreign_key_list."from",
+    foreign_key_list."to"
+from pragma_database_list as database_list
+join pragma_table_list as table_list
+    on table_list.schema = database_list.name and substr(table_list.name, 1, 7) <> 'sqlite_'
+join pragma_foreign_key_list(table_list.name, database_list.name) as foreign_key_list
+order by database_list.seq, table_list.name, foreign_key_list.id, foreign_key_list.seq
+"""
+
+# Indexes of every table in every database, one row per indexed column
+INDEXES_SQL = """
+select database_list.name, table_list.name, index_list.name, index_list."unique", index_info.name
+from pragma_database_list as database_list
+join pragma_table_list as table_list
+    on table_list.schema = database_list.name and substr(table_list.name, 1, 7) <> 'sqlite_'
+join pragma_index_list(table_list.name, database_list.name) as index_list
+join pragma_index_info(index_list.name, database_list.name) as index_info
+order by database_list.seq, table_list.name, index_list.name, index_info.seqno
+"""
+
+# Longest minimum or maximum text value reported in column statistics before it's cut short
+MAX_STATISTIC_LENGTH = 64
+
+
+def _shorten_statistic(value: Any) -> Any:
+    if isinstance(value, (str, bytes)) and len(value) > MAX_STATISTIC_LENGTH:
+        return value[:MAX_STATISTIC_LENGTH]
+    return value
+
+
+# Number of blocks of rows, spread evenly over the rowids of a table, that its column statistics are computed over
+STATISTICS_BLOCKS = 32
+
+
+async def _spread_sample_sql(
+    sqlite_connection: aiosqlite.Connection, table: str, sample_rows: int
+) -> tuple[str, list[int]]:
+    """Return SQL selecting about `sample_rows` rows of the table in blocks spread evenly over its rowids, each read by
+    seeking to it, so that the sample covers the whole table rather than only its oldest rows, and its parameters.
+    """
+    try:
+        [(low, high)] = await sqlite_connection.execute_fetchall(f"select min(rowid), max(rowid) from {table}")
+    except sqlite3.OperationalError:
+        # Tables without rowids can only be read from the start
+        return f"select * from {table} limit ?", [sample_rows]
+    if low is None or high - low + 1 <= sample_rows:
+        return f"select * from {table}", []
+    stride = (high - low + 1) / STATISTICS_BLOCKS
+    block_rows = -(-sample_rows // STATISTICS_BLOCKS)
+    blocks = []
+    parameters = []
+    for index in range(STATISTICS_BLOCKS):
+        blocks.append(f"select * from (select * from {table} where rowid >= ? and rowid < ? order by rowid limit ?)")
+        parameters += [low + int(index * stride), low + int((index + 1) * stride), block_rows]
+    return " union all ".join(blocks), parameters
+
+
+async def get_table_details(
+    pool: ConnectionPool, sample_rows: int = 10_000, timeout: float = 0
+) -> dict[tuple[str, str], dict[str, Any]]:
+    """Return the declared column types, keys, indexes, estimated row count (from sqlite_stat1, filled in by ANALYZE),
+    and column statistics over about `sample_rows` rows spread over every table, keyed by database and table name.
+    """
+    details: dict[tuple[str, str], dict[str, Any]] = {}
+    table_types: dict[tuple[str, str], str] = {}
+    async with pool.reader() as sqlite_connection:
+        for (
+            database_name,
+            table_name,
+            table_type,
+            column_name,
+            column_type,
+            primary_key,
+        ) in await sqlite_connection.execute_fetchall(COLUMN_DETAILS_SQL):
+            table_types[(database_name, table_name)] = table_type
+            table_details = details.setdefault((database_name, table_name), {"column_types": {}})
+            table_details["column_types"][column_name] = column_type
+            if primary_key:
+                table_details.setdefault("primary_key", []).append((primary_key, column_name))
+        for table_details in details.values():
+            if "primary_key" in table_details:
+                table_details["primary_key"] = [column for _, column in sorted(table_details["primary_key"])]
+        foreign_keys: dict[tuple[str, str, int], dict[str, Any]] = {}
+        for (
+            database_name,
+            table_name,
+            key_id,
+            references_table,
+            from_column,
+            to_column,
+        ) in await sqlite_connection.execute_fetchall(FOREIGN_KEYS_SQL):
+            foreign_key = foreign_keys.get((database_name, table_name, key_id))
+            if foreign_key is None:
+                foreign_key = {"columns": [], "references_table": references_table, "references_columns": []}
+                foreign_keys[(database_name, table_name, key_id)] = foreign_key
+                details[(database_name, table_name)].setdefault("foreign_keys", []).append(foreign_key)
+            foreign_key["columns"].append(from_column)
+            foreign_key["references_columns"].append(to_column)
+        indexes: dict[tuple[str, str, str], dict[str, Any]] = {}
+        for database_name, table_name, index_name, unique, column_name in await sqlite_connection.execute_fetchall(
+            INDEXES_SQL
+        ):
+            index = indexes.get((database_name, table_name, index_name))
+            if index is None:
+                index = {"name": index_name, "unique": bool(unique), "columns": []}
+                indexes[(database_name, table_name, index_name)] = index
+                details[(database_name, table_name)].setdefault("indexes", []).append(index)
+            index["columns"].append(column_name)
+        stat_databases = [
+            database_name
+            for (database_name,) in await sqlite_connection.execute_fetchall(
+                "select schema from pragma_table_list where name = 'sqlite_stat1'"
+            )
+        ]
+        for database_name in stat_databases:
+            for table_name, stat in await sqlite_connection.execute_fetchall(
+                f"select tbl, stat from {quote_identifier(database_name)}.sqlite_stat1"
+            ):
+                if (database_name, table_name) in details and stat and stat.split()[0].isdigit():
+                    table_details = details[(database_name, table_name)]
+                    table_details["estimated_rows"] = max(table_details.get("estimated_rows", 0), int(stat.split()[0]))
+        for (database_name, table_name), table_details in details.items():
+            # Views and virtual tables can be arbitrarily expensive to read, so only sample ordinary tables
+            if table_types[(database_name, table_name)] != "table" or not sample_rows:
+                continue
+            columns = list(table_details["column_types"])
+            try:
+                async with query_budget(sqlite_connection, timeout=timeout):
+                    sample_sql, sample_parameters = await _spread_sample_sql(
+                        sqlite_connection,
+                        f"{quote_identifier(database_name)}.{quote_identifier(table_name)}",
+                        sample_rows,
+                    )
+                    statistics_sql = (
+                        "select count(*), "
+                        + ", ".join(
+                            f"count(distinct {column}), sum({column} is null), min({column}), max({column})"
+                            for column in map(quote_identifier, columns)
+                        )
+                        + f" from ({sample_sql})"
+                    )
+                    statistics_row = list(await sqlite_connection.execute_fetchall(statistics_sql, sample_parameters))[
+                        0
+                    ]
+            except (QueryInterruptedError, sqlite3.Error) as error:
+                logging.info(f"Skipping column statistics of {database_name}.{table_name}: {error}")
+                continue
+            row_count = statistics_row[0]
+            table_details["sampled_rows"] = row_count
+            table_details["column_statistics"] = {
+                column: {
+                    "distinct": statistics_row[1 + 4 * column_index],
+                    "null_fraction": round(statistics_row[2 + 4 * column_index] / row_count, 4) if row_count else 0,
+                    "min": _shorten_statistic(statistics_row[3 + 4 * column_index]),
+                    "max": _shorten_statistic(statistics_row[4 + 4 * column_index]),
+                }
+                for column_index, column in enumerate(columns)
+            }
+    return details
+
+
+class CatalogCache:
+    """Catalog and its serialized JSON, rebuilt only when the schema version of the databases changes, or also when
+    the data changes for the enriched catalog.
+    """
+
+    def __init__(self, pool: ConnectionPool, metadata: RootMetadata, sample_rows: int = 10_000, timeout: float = 0):
+        self.pool = pool
+        self.metadata = metadata
+        self.sample_rows = sample_rows
+        self.timeout = timeout
+        self._schema_version: tuple[int, ...] | None = None
+        self._catalog: RootMetadata | None = None
+        self._catalog_json: str | None = None
+        self._lock = anyio.Lock()
+        self._enriched_version: tuple | None = None
+        self._enriched: dict[str, Any] | None = None
+        self._enriched_json: str | None = None
+        self._enriched_lock = anyio.Lock()
+        self._index: CatalogIndex | None = None
+
+    async def get(self) -> tuple[RootMetadata, str]:
+        schema_version = await get_schema_version(self.pool)
+        async with self._lock:
+            if self._catalog is None or self._catalog_json is None or schema_version != self._schema_version:
+                logging.debug(f"Building catalog for schema version {schema_version}")
+                self._catalog = await get_catalog(pool=self.pool, metadata=self.metadata)
+                self._catalog_json = self._catalog.model_dump_json(exclude_none=True)
+                self._schema_version = schema_version
+            return self._catalog, self._catalog_json
+
+    def seed(self, catalog: RootMetadata, catalog_json: str, schema_version: tuple[int, ...]) -> None:
+        """Start from a catalog built earlier for the given schema version, e.g. loaded from a snapshot."""
+        self._catalog, self._catalog_json, self._schema_version = catalog, catalog_json, schema_version
+
+    async def get_enriched(self) -> tuple[dict[str, Any], str]:
+        async with self._enriched_lock:
+            catalog, _ = await self.get()
+            version = (self._schema_version, await self.pool.data_version())
+            if self._enriched is None or self._enriched_json is None or version != self._enriched_version:
+                logging.debug(f"Building enriched catalog for version {version}")
+                details = await get_table_details(self.pool, sample_rows=self.sample_rows, timeout=self.timeout)
+                catalog_dict = catalog.model_dump(exclude_none=True)
+                for (database_name, table_name), table_details in details.items():
+                    table = catalog_dict["databases"].get(database_name, {}).get("tables", {}).get(table_name)
+                    if table is not None:
+                        table.update(table_details)
+                self._enriched = catalog_dict
+                self._enriched_json = json.dumps(
+                    catalog_dict, ensure_ascii=False, separators=(",", ":"), default=_json_default
+                )
+                self._enriched_version = version
+            return self._enriched, self._enriched_json
+
+    async def get_index(self) -> "CatalogIndex":
+        catalog, _ = await self.get()
+        if self._index is None or self._index.catalog is not catalog:
+            self._index = CatalogIndex(catalog)
+        return self._index
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words, splitting identifiers like order_items and orderItems into their parts too."""
+    return [word.lower() for word in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+", text)]
+
+
+class CatalogIndex:
+    """Inverted index of the words in the names and metadata of the tables and columns of a catalog, matching search
+    terms to equal words, words starting with them, and words spelled closely to them.
+    """
+
+    TABLE_WEIGHT = 3.0
+    COLUMN_WEIGHT = 2.0
+    DESCRIPTION_WEIGHT = 1.0
+    # Factor applied to the weight of a match on a word that only starts like, or is spelled like, the search term
+    INEXACT_FACTOR = 0.5
+
+    def __init__(self, catalog: RootMetadata):
+        self.catalog = catalog
+        # Word -> list of (database, table, column or None, weight)
+        self.postings: dict[str, list[tuple[str, str, str | None, float]]] = {}
+        for database_name, database in catalog.databases.items():
+            for table_name, table in database.tables.items():
+                self._add(table_name, database_name, table_name, None, self.TABLE_WEIGHT)
+                for key, value in table:
+                    if key != "columns" and isinstance(value, str):
+                        self._add(value, database_name, table_name, None, self.DESCRIPTION_WEIGHT)
+                for column_name, column_description in table.columns.items():
+                    self._add(column_name, database_name, table_name, column_name, self.COLUMN_WEIGHT)
+                    self._add(column_description, database_name, table_name, column_name, self.DESCRIPTION_WEIGHT)
+        self.vocabulary = sorted(self.postings)
+
+    def _add(self, text: str, database_name: str, table_name: str, column_name: str | None, weight: float) -> None:
+        for word in set(tokenize(text)):
+            self.postings.setdefault(word, []).append((database_name, table_name, column_name, weight))
+
+    def search(self, query: str, limit: int = 20) -> list[dict[str, Any]]:
+        scores: dict[tuple[str, str], float] = {}
+        matched_columns: dict[tuple[str, str], dict[str, None]] = {}
+        for term in set(tokenize(query)):
+            factors = {term: 1.0} if term in self.postings else {}
+            for word in self.vocabulary[bisect.bisect_left(self.vocabulary, term) :]:
+                if not word.startswith(term):
+                    break
+                factors.setdefault(word, self.INEXACT_FACTOR)
+            for word in difflib.get_close_matches(term, self.vocabulary, n=5, cutoff=0.8):
+                factors.setdefault(word, self.INEXACT_FACTOR)
+            for word, factor in factors.items():
+                for database_name, table_name, column_name, weight in self.postings[word]:
+                    scores[(database_name, table_name)] = scores.get((database_name, table_name), 0) + weight * factor
+                    columns = matched_columns.setdefault((database_name, table_name), {})
+                    if column_name is not None:
+                        columns[column_name] = None
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [
+            {
+                "database": database_name,
+                "table": table_name,
+                "score": round(score, 2),
+                "matched_columns": list(matched_columns[(database_name, table_name)]),
+            }
+            for (database_name, table_name), score in ranked
+        ]
+
+
+def filter_catalog(catalog: dict[str, Any], table_names: Sequence[str]) -> dict[str, Any]:
+    """Return a serialized catalog with only the given tables and no canned queries.
+    Each table is named either on its own, matching it in every database that has it, or as "database.table".
+    """
+    filtered = {key: value for key, value in catalog.items() if key != "databases"} | {"databases": {}}
+    unknown_tables = []
+    for table_name in table_names:
+        found = False
+        for database_name, database in catalog["databases"].items():
+            for candidate in (table_name, table_name.removeprefix(f"{database_name}.")):
+                if candidate in database["tables"]:
+                    filtered_database = filtered["databases"].setdefault(
+                        database_name,
+                        {key: value for key, value in database.items() if key not in ("tables", "queries")}
+                        | {"tables": {}},
+                    )
+                    filtered_database["tables"][candidate] = database["tables"][candidate]
+                    found = True
+                    break
+        if not found:
+            unknown_tables.append(table_name)
+    if unknown_tables:
+        raise ValueError(f"Unknown tables: {', '.join(unknown_tables)}. Call sqlite_list_tables() to get their names.")
+    return filtered
+
+
+# Number of rows pulled from the SQLite thread per round-trip while rendering results
+FETCH_SIZE = 256
+
+
+class ResultRows:
+    """Rows of an executed cursor, fetched in batches, with a buffer of rows that were fetched but not rendered yet."""
+
+    def __init__(self, cursor: aiosqlite.Cursor):
+        self.cursor = cursor
+        self.description = cursor.description
+        self._buffer: list[Any] = []
+
+    async def take(self, count: int) -> list[Any]:
+        if self._buffer:
+            rows, self._buffer = self._buffer[:count], self._buffer[count:]
+            return rows
+        return list(await self.cursor.fetchmany(count))
+
+    def put_back(self, rows: list[Any]) -> None:
+        self._buffer = rows + self._buffer
+
+    async def has_more(self) -> bool:
+        rows = await self.take(1)
+        self.put_back(rows)
+        return len(rows) > 0
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+class ResultFormat(ABC):
+    """Serializer for query results. Rows are serialized one batch at a time so output can stop at any row."""
+
+    # Text between consecutive serialized rows
+    separator = ""
+
+    def header(self, columns: list[str]) -> str:
+        return ""
+
+    @abstractmethod
+    def format_rows(self, rows: list[Any]) -> list[str]: ...
+
+    def footer(self) -> str:
+        return ""
+
+
+class HtmlFormat(ResultFormat):
+    """HTML table, which performs best for LLMs according to Siu et al https://arxiv.org/pdf/2305.13062"""
+
+    def header(self, columns: list[str]) -> str:
+        return "<table><tr>" + "".join(f"<th>{html.escape(column)}</th>" for column in columns) + "</tr>"
+
+    def format_rows(self, rows: list[Any]) -> list[str]:
+        # Numbers and NULLs never contain characters that need escaping
+        return [
+            "<tr>"
+            + "".join(
+                f"<td>{value}</td>"
+                if isinstance(value, (int, float)) or value is None
+                else f"<td>{html.escape(str(value))}</td>"
+                for value in row
+            )
+            + "</tr>"
+            for row in rows
+        ]
+
+    def footer(self) -> str:
+        return "</table>"
+
+
+class CsvFormat(ResultFormat):
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def _write(self, rows: list[Any]) -> list[str]:
+        lines = []
+        for row in rows:
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._writer.writerow(row)
+            lines.append(self._buffer.getvalue())
+        return lines
+
+    def header(self, columns: list[str]) -> str:
+        return self._write([columns])[0]
+
+    def format_rows(self, rows: list[Any]) -> list[str]:
+        return self._write(rows)
+
+
+class JsonLinesFormat(ResultFormat):
+    """One JSON object per row, keyed by column name."""
+
+    def header(self, columns: list[str]) -> str:
+        self._columns = columns
+        return ""
+
+    def format_rows(self, rows: list[Any]) -> list[str]:
+        return [
+            json.dumps(dict(zip(self._columns, row)), ensure_ascii=False, default=_json_default) + "\n" for row in rows
+        ]
+
+
+class CompactJsonFormat(ResultFormat):
+    """A single JSON object with the column names listed once followed by an array of row arrays."""
+
+    separator = ","
+
+    def header(self, columns: list[str]) -> str:
+        return '{"columns":' + json.dumps(columns, ensure_ascii=False, separators=(",", ":")) + ',"rows":['
+
+    def format_rows(self, rows: list[Any]) -> list[str]:
+        return [json.dumps(row, ensure_ascii=False, separators=(",", ":"), default=_json_default) for row in rows]
+
+    def footer(self) -> str:
+        return "]}"
+
+
+class MarkdownFormat(ResultFormat):
+    @staticmethod
+    def _cell(value: Any) -> str:
+        return str(value).replace("|", "\\|").replace("\n", " ")
+
+    def header(self, columns: list[str]) -> str:
+        return "| " + " | ".join(self._cell(column) for column in columns) + " |\n|" + "---|" * len(columns) + "\n"
+
+    def format_rows(self, rows: list[Any]) -> list[str]:
+        return ["| " + " | ".join(self._cell(value) for value in row) + " |\n" for row in rows]
+
+
+RESULT_FORMATS: dict[str, type[ResultFormat]] = {
+    "html": HtmlFormat,
+    "csv": CsvFormat,
+    "jsonl": JsonLinesFormat,
+    "json": CompactJsonFormat,
+    "markdown": MarkdownFormat,
+}
+
+
+def get_result_format(name: str) -> ResultFormat:
+    if name not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result format '{name}'. Supported formats: {', '.join(RESULT_FORMATS)}.")
+    return RESULT_FORMATS[name]()
+
+
+async def render_results(
+    result_rows: ResultRows, result_format: ResultFormat, max_rows: int = 0, max_bytes: int = 0
+) -> tuple[str, int, str | None]:
+    """Serialize rows until they run out or `max_rows` rows or `max_bytes` bytes are reached.
+    Returns the serialized results, their number of rows, and a description of the limit hit if rows remain.
+    """
+    header = result_format.header([column_description[0] for column_description in result_rows.description])
+    footer = result_format.footer()
+    separator = result_format.separator
+    parts = [header]
+    total_bytes = len(header.encode()) + len(footer.encode())
+    row_count = 0
+    limit = None
+    while limit is None:
+        batch_size = FETCH_SIZE if not max_rows else min(FETCH_SIZE, max_rows - row_count)
+        if batch_size == 0:
+            if await result_rows.has_more():
+                limit = f"the limit of {max_rows} rows"
+            break
+        rows = await result_rows.take(batch_size)
+        if not rows:
+            break
+        for row_index, row_text in enumerate(result_format.format_rows(rows)):
+            if row_count > 0:
+                row_text = separator + row_text
+            row_bytes = len(row_text.encode())
+            if max_bytes and total_bytes + row_bytes > max_bytes:
+                result_rows.put_back(rows[row_index:])
+                limit = f"the limit of {max_bytes} bytes"
+                break
+            parts.append(row_text)
+            total_bytes += row_bytes
+            row_count += 1
+    parts.append(footer)
+    return "".join(parts), row_count, limit
+
+
+# Number of SQLite virtual machine instructions between checks of the query budget
+PROGRESS_STEPS = 1000
+
+
+class QueryInterruptedError(Exception):
+    pass
+
+
+class QueryBudget:
+    """Progress handler that aborts the running statement once it's past its deadline, has run more than `max_steps`
+    virtual machine instructions, or has been cancelled. Runs in the connection's thread, so it's kept trivially cheap.
+    """
+
+    def __init__(self, timeout: float = 0, max_steps: int = 0):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.max_steps = max_steps
+        self.steps = 0
+        self.cancelled = False
+        self.reason: str | None = None
+
+    def __call__(self) -> int:
+        self.steps += PROGRESS_STEPS
+        if self.cancelled:
+            self.reason = "the request was cancelled"
+        elif self.deadline is not None and time.monotonic() > self.deadline:
+            self.reason = f"it ran longer than the limit of {self.timeout:g} seconds"
+        elif self.max_steps and self.steps > self.max_steps:
+            self.reason = f"it ran more than the limit of {self.max_steps} steps"
+        # Returning non-zero interrupts the statement
+        return self.reason is not None
+
+
+@asynccontextmanager
+async def query_budget(
+    sqlite_connection: aiosqlite.Connection, timeout: float = 0, max_steps: int = 0
+) -> AsyncIterator[QueryBudget]:
+    """Enforce a time and step budget on the statements run on the connection inside the context.
+    Cancelling the surrounding task (e.g. when the MCP client cancels the request) interrupts the running statement too.
+    """
+    budget = QueryBudget(timeout=timeout, max_steps=max_steps)
+    await sqlite_connection.set_progress_handler(budget, PROGRESS_STEPS)
+    try:
+        yield budget
+    except anyio.get_cancelled_exc_class():
+        budget.cancelled = True
+        raise
+    except sqlite3.OperationalError as error:
+        if budget.reason:
+            raise QueryInterruptedError(f"Query interrupted because {budget.reason}.") from error
+        raise
+    finally:
+        # Queued behind the running statement, so this also waits for an interrupted statement to stop
+        with anyio.CancelScope(shield=True):
+            # sqlite3 removes the progress handler when given None, which aiosqlite's annotations leave out
+            await sqlite_connection.set_progress_handler(None, 0)  # pyright: ignore[reportArgumentType]
+
+
+async def execute(
+    pool: ConnectionPool,
+    sql: str,
+    parameters: dict[str, str] = {},
+    write: bool = False,
+    max_rows: int = 0,
+    max_bytes: int = 0,
+    result_format: str = "html",
+    timeout: float = 0,
+    max_steps: int = 0,
+    call_stats: "CallStats | None" = None,
+) -> str:
+    """Execute the SQL and serialize up to `max_rows` rows or `max_bytes` bytes of its results in the given format.
+    The statement is interrupted after `timeout` seconds or `max_steps` virtual machine steps (0 meaning unlimited).
+    """
+    async with pool.writer() if write else pool.reader() as sqlite_connection:
+        return await execute_on(
+            sqlite_connection,
+            sql,
+            parameters,
+            max_rows=max_rows,
+            max_bytes=max_bytes,
+            result_format=result_format,
+            timeout=timeout,
+            max_steps=max_steps,
+            call_stats=call_stats,
+        )
+
+
+async def execute_on(
+    sqlite_connection: aiosqlite.Connection,
+    sql: str,
+    parameters: dict[str, str] = {},
+    max_rows: int = 0,
+    max_bytes: int = 0,
+    result_format: str = "html",
+    timeout: float = 0,
+    max_steps: int = 0,
+    call_stats: "CallStats | None" = None,
+) -> str:
+    """Like execute(), on a connection that the caller already holds, e.g. to run several queries in one transaction."""
+    async with query_budget(sqlite_connection, timeout=timeout, max_steps=max_steps):
+        cursor = await sqlite_connection.execute(sql, parameters)
+        if not cursor.description:
+            return "Statement executed successfully"
+        result_text, row_count, limit = await render_results(
+            ResultRows(cursor), get_result_format(result_format), max_rows=max_rows, max_bytes=max_bytes
+        )
+        await cursor.close()
+    if call_stats is not None:
+        call_stats.rows += row_count
+    if limit:
+        result_text += (
+            f"\nResults truncated to the first {row_count} rows to stay within {limit}."
+            " Add a LIMIT, filter, or aggregate to the query, or pass page_size to page through the rest."
+        )
+    return result_text
+
+
+# Number of rows pulled from the SQLite thread and written to the file per round-trip while exporting results, and
+# number of rows at the start of an export returned along with its summary
+EXPORT_FETCH_SIZE = 4096
+EXPORT_SAMPLE_ROWS = 5
+
+# File name extension of exported results in each of RESULT_FORMATS
+EXPORT_EXTENSIONS = {"html": "html", "csv": "csv", "jsonl": "jsonl", "json": "json", "markdown": "md"}
+
+
+async def export_results(
+    pool: ConnectionPool,
+    sql: str,
+    path: str,
+    result_format: str = "csv",
+    timeout: float = 0,
+    max_steps: int = 0,
+    call_stats: "CallStats | None" = None,
+) -> dict[str, Any]:
+    """Stream all results of the SQL to a file at `path` EXPORT_FETCH_SIZE rows at a time, moving it there when done.
+    Returns a summary of the export: the file's URI, its number of rows and bytes, the columns, and the first rows.
+    """
+    serializer = get_result_format(result_format)
+    temporary_path = f"{path}.tmp"
+    row_count = total_bytes = 0
+    sample_rows: list[Any] = []
+    try:
+        async with pool.reader() as sqlite_connection:
+            async with query_budget(sqlite_connection, timeout=timeout, max_steps=max_steps):
+                cursor = await sqlite_connection.execute(sql)
+                columns = [column_description[0] for column_description in cursor.description or []]
+                async with await anyio.open_file(temporary_path, "w", encoding="utf-8", newline="") as export_file:
+                    header = serializer.header(columns)
+                    await export_file.write(header)
+                    total_bytes += len(header.encode())
+                    while rows := list(await cursor.fetchmany(EXPORT_FETCH_SIZE)):
+                        row_texts = serializer.format_rows(rows)
+                        chunk = (serializer.separator if row_count else "") + serializer.separator.join(row_texts)
+                        await export_file.write(chunk)
+                        total_bytes += len(chunk.encode())
+                        sample_rows += rows[: EXPORT_SAMPLE_ROWS - len(sample_rows)]
+                        row_count += len(rows)
+                    footer = serializer.footer()
+                    await export_file.write(footer)
+                    total_bytes += len(footer.encode())
+                await cursor.close()
+        os.replace(temporary_path, path)
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(temporary_path)
+    if call_stats is not None:
+        call_stats.rows += row_count
+    return {
+        "uri": Path(path).resolve().as_uri(),
+        "format": result_format,
+        "rows": row_count,
+        "bytes": total_bytes,
+        "columns": columns,
+        "sample_rows": sample_rows,
+    }
+
+
+async def execute_many(
+    pool: ConnectionPool,
+    sql: str,
+    parameter_sets: Sequence[dict[str, Any]],
+    chunk_size: int = 0,
+    timeout: float = 0,
+    max_steps: int = 0,
+) -> str:
+    """Execute the writing SQL once for each of `parameter_sets` on the writer connection, committing every `chunk_size`
+    of them (0 meaning all at once), so that a failing chunk only rolls back itself.
+    """
+    chunk_size = chunk_size or max(len(parameter_sets), 1)
+    committed = changes = transactions = 0
+    async with pool.writer() as sqlite_connection:
+        try:
+            async with query_budget(sqlite_connection, timeout=timeout, max_steps=max_steps):
+                for start in range(0, len(parameter_sets), chunk_size):
+                    chunk = parameter_sets[start : start + chunk_size]
+                    cursor = await sqlite_connection.executemany(sql, chunk)
+                    # The total number of rows changed by every execution, or -1 for statements that change none
+                    changes += max(cursor.rowcount, 0)
+                    await sqlite_connection.commit()
+                    committed += len(chunk)
+                    transactions += 1
+        except (sqlite3.Error, QueryInterruptedError) as error:
+            if not committed:
+                raise
+            raise ValueError(
+                f"Committed the first {committed} of {len(parameter_sets)} parameter sets, "
+                f"then the next chunk failed and was rolled back: {error}"
+            ) from error
+    return (
+        f"Statement executed successfully for {committed} parameter sets, changing {changes} rows "
+        f"in {transactions} transaction{'s' if transactions != 1 else ''}"
+    )
+
+
+class _QueuedWrite:
+    def __init__(self, sql: str, parameters: dict[str, Any]):
+        self.sql = sql
+        self.parameters = parameters
+        self.done = anyio.Event()
+        self.error: Exception | None = None
+
+
+class GroupCommitter:
+    """Queue committing writes that arrive within `delay` seconds of each other in one transaction, each in a savepoint
+    of its own, and returning to each caller once its own write is committed.
+    """
+
+    def __init__(self, pool: ConnectionPool, delay: float, timeout: float = 0, max_steps: int = 0):
+        self.pool = pool
+        self.delay = delay
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.groups = 0
+        self.writes = 0
+        self._queued: list[_QueuedWrite] = []
+
+    async def write(self, sql: str, parameters: dict[str, Any]) -> str:
+        queued_write = _QueuedWrite(sql, parameters)
+        self._queued.append(queued_write)
+        if len(self._queued) == 1:
+            # The write that starts a group commits all of it, even if its own caller is cancelled in the meantime
+            with anyio.CancelScope(shield=True):
+                await anyio.sleep(self.delay)
+                group, self._queued = self._queued, []
+                await self._commit(group)
+        else:
+            await queued_write.done.wait()
+        if queued_write.error is not None:
+            raise queued_write.error
+        return "Statement executed successfully"
+
+    async def _commit(self, group: list[_QueuedWrite]) -> None:
+        try:
+            async with self.pool.writer() as sqlite_connection:
+                await sqlite_connection.execute("begin")
+                for queued_write in group:
+                    await sqlite_connection.execute("savepoint queued_write")
+                    try:
+                        async with query_budget(sqlite_connection, timeout=self.timeout, max_steps=self.max_steps):
+                            await sqlite_connection.execute(queued_write.sql, queued_write.parameters)
+                    except (sqlite3.Error, QueryInterruptedError) as error:
+                        await sqlite_connection.execute("rollback to queued_write")
+                        queued_write.error = error
+                    await sqlite_connection.execute("release queued_write")
+            self.groups += 1
+            self.writes += len(group)
+        except (sqlite3.Error, PoolBusyError) as error:
+            # Nothing in the group was committed, e.g. because the transaction itself couldn't start or commit
+            for queued_write in group:
+                queued_write.error = queued_write.error or error
+        finally:
+            for queued_write in group:
+                queued_write.done.set()
+
+
+# String literals, quoted identifiers, and comments, whose text is never normalized or rewritten like the rest of SQL.
+# Line comments include the newline ending them, which mustn't be collapsed into a space that would put the following
+# code inside the comment.
+SQL_QUOTED_OR_COMMENT = re.compile(
+    r"""'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?|--[^\n]*\n?|/\*.*?(?:\*/|$)""", re.DOTALL
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse runs of whitespace into single spaces, except inside literals, quoted identifiers, and comments."""
+    parts = []
+    position = 0
+    for match in SQL_QUOTED_OR_COMMENT.finditer(sql):
+        parts += [re.sub(r"\s+", " ", sql[position : match.start()]), match.group()]
+        position = match.end()
+    parts.append(re.sub(r"\s+", " ", sql[position:]))
+    return "".join(parts).strip().rstrip(";").rstrip()
+
+
+def mask_literals_and_comments(sql: str) -> str:
+    """Blank out everything quoted but double-quoted identifiers, and comments, keeping other text where it was."""
+    return SQL_QUOTED_OR_COMMENT.sub(
+        lambda match: match.group() if match.group().startswith('"') else " " * len(match.group()), sql
+    )
+
+
+class ResultCache:
+    """Least-recently-used cache of serialized query results, ignored once the data version of the database changes."""
+
+    NON_DETERMINISTIC = re.compile(
+        r"\b(random|randomblob|changes|total_changes|last_insert_rowid)\s*\(|'now'"
+        # The current time, either as a keyword or from a date and time function called without a time value
+        r"|\bcurrent_(timestamp|date|time)\b|\b(date|time|datetime|julianday|unixepoch)\s*\(\s*\)"
+        r"|\bstrftime\s*\(\s*'[^']*'\s*\)",
+        flags=re.IGNORECASE,
+    )
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 16_000_000, ttl: float = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = 0
+        self._entries: OrderedDict[tuple, tuple[str, tuple, float]] = OrderedDict()
+
+    @staticmethod
+    def key(sql: str, parameters: dict[str, str], *options: Any) -> tuple:
+        return (normalize_sql(sql), tuple(sorted(parameters.items())), *options)
+
+    def cacheable(self, sql: str) -> bool:
+        return self.max_entries > 0 and not self.NON_DETERMINISTIC.search(sql)
+
+    def get(self, key: tuple, data_version: tuple) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None and (entry[1] != data_version or entry[2] <= time.monotonic()):
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: tuple, data_version: tuple, result: str) -> None:
+        result_bytes = len(result.encode())
+        if result_bytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (result, data_version, time.monotonic() + self.ttl)
+        self._total_bytes += result_bytes
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple) -> None:
+        result, _, _ = self._entries.pop(key)
+        self._total_bytes -= len(result.encode())
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._total_bytes}
+
+
+# Identifier, double-quoted or bare, optionally qualified with a database name
+_IDENTIFIER = r'(?:"(?:[^"]|"")+"|\w+)'
+_QUALIFIED_IDENTIFIER = rf"{_IDENTIFIER}(?:\s*\.\s*{_IDENTIFIER})?"
+# Table named in a FROM or JOIN clause, optionally followed by an alias
+_TABLE_REFERENCE = re.compile(
+    rf"\b(?:from|join)\s+({_QUALIFIED_IDENTIFIER})(?:\s+(?:as\s+)?(?!(?:where|join|on|using|left|right|full|inner|"
+    rf"cross|natural|outer|group|order|limit|union|except|intersect|window|having|indexed|not)\b)({_IDENTIFIER}))?",
+    re.IGNORECASE,
+)
+_SCAN_DETAIL = re.compile(rf"^SCAN ({_QUALIFIED_IDENTIFIER})(?: USING (COVERING )?INDEX .*)?$")
+# Maximum number of columns in a suggested index
+MAX_INDEX_COLUMNS = 6
+
+
+def _unquote(identifier: str) -> str:
+    identifier = identifier.strip()
+    if identifier.startswith('"') and identifier.endswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _split_qualified(name: str) -> tuple[str | None, str]:
+    parts = re.findall(_IDENTIFIER, name)
+    if len(parts) == 2:
+        return _unquote(parts[0]), _unquote(parts[1])
+    return None, _unquote(parts[0])
+
+
+class QueryPlanAnalyzer:
+    """Flags full scans of tables with at least `large_table_rows` rows in query plans, and suggests covering indexes
+    for them that the planner uses on an in-memory copy of the schema, like the .expert command of the sqlite3 shell.
+    """
+
+    def __init__(self, pool: ConnectionPool, large_table_rows: int = 10_000):
+        self.pool = pool
+        self.large_table_rows = large_table_rows
+        # Plain sqlite3 connection used from worker threads, as it holds no data and only ever runs quick statements
+        self._schema_copy: sqlite3.Connection | None = None
+        self._schema_copy_version: tuple[int, ...] | None = None
+        self._lock = anyio.Lock()
+
+    async def _copy_schema(self) -> sqlite3.Connection:
+        """Return an in-memory database with the tables, indexes, and views of every database, kept until the schema
+        changes.
+        """
+        schema_version = await get_schema_version(self.pool)
+        if self._schema_copy is not None and schema_version == self._schema_copy_version:
+            return self._schema_copy
+        schema_statements = []
+        async with self.pool.reader() as sqlite_connection:
+            databases = [
+                database_name
+                for _, database_name, _ in await sqlite_connection.execute_fetchall("pragma database_list")
+                if database_name != "temp"
+            ]
+            for database_name in databases:
+                if database_name != "main":
+                    schema_statements.append("attach database ':memory:' as " + quote_identifier(database_name))
+                schema_rows = await sqlite_connection.execute_fetchall(
+                    f"select sql from {quote_identifier(database_name)}.sqlite_schema "
+                    "where sql is not null and type in ('table', 'index', 'view') and substr(name, 1, 7) <> 'sqlite_' "
+                    "order by case type when 'table' then 0 when 'index' then 1 else 2 end"
+                )
+                for (schema_sql,) in schema_rows:
+                    if database_name != "main":
+                        # Create each object in the attached database of the same name rather than in main
+                        schema_sql = re.sub(
+                            r"^(\s*create\s+(?:unique\s+|virtual\s+)?(?:table|index|view)\s+(?:if\s+not\s+exists\s+)?)",
+                            rf"\1{quote_identifier(database_name)}.",
+                            schema_sql,
+                            flags=re.IGNORECASE,
+                        )
+                    schema_statements.append(schema_sql)
+
+        def build_schema_copy() -> sqlite3.Connection:
+            schema_copy = sqlite3.connect(":memory:", check_same_thread=False)
+            for schema_sql in schema_statements:
+                try:
+                    schema_copy.execute(schema_sql)
+                except sqlite3.Error as error:
+                    logging.debug(f"Leaving out of the schema copy: {schema_sql} ({error})")
+            return schema_copy
+
+        if self._schema_copy is not None:
+            self._schema_copy.close()
+        self._schema_copy = await anyio.to_thread.run_sync(build_schema_copy)
+        self._schema_copy_version = schema_version
+        return self._schema_copy
+
+    @staticmethod
+    def _try_index(
+        schema_copy: sqlite3.Connection, index_sql: str, drop_sql: str, sql: str, parameters: dict[str, Any]
+    ) -> list[Any]:
+        """Return the query plan of the SQL on the schema copy with the index added."""
+        schema_copy.execute(index_sql)
+        try:
+            return list(schema_copy.execute(f"explain query plan {sql}", parameters))
+        finally:
+            schema_copy.execute(drop_sql)
+
+    @staticmethod
+    async def _explain(sqlite_connection: aiosqlite.Connection, sql: str, parameters: dict[str, Any]) -> list[Any]:
+        return list(await sqlite_connection.execute_fetchall(f"explain query plan {sql}", parameters))
+
+    @staticmethod
+    def _format_plan(plan_rows: list[Any]) -> list[str]:
+        depths = {0: -1}
+        lines = []
+        for node_id, parent_id, _, detail in plan_rows:
+            depths[node_id] = depths.get(parent_id, -1) + 1
+            lines.append("  " * depths[node_id] + detail)
+        return lines
+
+    @staticmethod
+    def _referenced_columns(sql: str, names: set[str], columns: list[str]) -> tuple[list[str], list[str], list[str]]:
+        """Split the columns of a table that the SQL mentions into those compared for equality, those compared by range
+        or sorted by, and the rest. `names` are the table's name and aliases, which may qualify its columns.
+        """
+        lowered_sql = sql.lower()
+        qualifiers = "|".join(re.escape(name.lower()) for name in names)
+        equality, ranged, other = [], [], []
+        for column in columns:
+            quoted = re.escape(column.lower())
+            reference = rf'(?:(?:{qualifiers}|"(?:{qualifiers})")\s*\.\s*)?(?:\b{quoted}\b|"{quoted}")'
+            if not re.search(reference, lowered_sql):
+                continue
+            if re.search(rf"{reference}\s*(?:==?|\bis\b(?!\s+not)|\bin\b)|(?<![<>!])=\s*{reference}", lowered_sql):
+                equality.append(column)
+            elif re.search(
+                rf"{reference}\s*(?:[<>]=?|\bbetween\b|\blike\b|\bglob\b)|[<>]=?\s*{reference}"
+                rf"|\b(?:order|group)\s+by\b[^;]*?{reference}",
+                lowered_sql,
+            ):
+                ranged.append(column)
+            else:
+                other.append(column)
+        return equality, ranged, other
+
+    async def analyze(self, sql: str, parameters: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Return the query plan of the SQL, the large tables it scans in full, and indexes that would avoid them."""
+        if parameters is None:
+            parameters = {param: None for param in re.findall(r":(\w+)", sql)}
+        async with self.pool.reader() as sqlite_connection:
+            plan_rows = await self._explain(sqlite_connection, sql, parameters)
+            database_names = [
+                database_name
+                for _, database_name, _ in await sqlite_connection.execute_fetchall("pragma database_list")
+                if database_name != "temp"
+            ]
+            # Resolve the names that the plan uses, which are aliases where the SQL gives them
+            aliases: dict[str, tuple[str | None, str]] = {}
+            for table_reference, alias in _TABLE_REFERENCE.findall(sql):
+                database_name, table_name = _split_qualified(table_reference)
+                aliases[_unquote(alias) if alias else table_name] = (database_name, table_name)
+            scans = []
+            for _, _, _, detail in plan_rows:
+                match = _SCAN_DETAIL.match(detail)
+                # A scan of a covering index reads less than the table but still every row
+                if not match:
+                    continue
+                database_name, table_name = _split_qualified(match.group(1))
+                if database_name is None and table_name in aliases:
+                    database_name, table_name = aliases[table_name]
+                candidates = [database_name] if database_name else database_names
+                for candidate in candidates:
+                    table_rows = list(
+                        await sqlite_connection.execute_fetchall(
+                            "select type from pragma_table_list where schema = ? and name = ?",
+                            (candidate, table_name),
+                        )
+                    )
+                    if table_rows and table_rows[0][0] == "table":
+                        database_name = candidate
+                        break
+                else:
+                    # Views, CTEs, subqueries, and virtual tables have no indexes to suggest
+                    continue
+                estimated_rows = await self._estimate_rows(sqlite_connection, database_name, table_name)
+                if estimated_rows is not None and estimated_rows < self.large_table_rows:
+                    continue
+                columns = [
+                    column_name
+                    for (column_name,) in await sqlite_connection.execute_fetchall(
+                        "select name from pragma_table_info(?, ?)", (table_name, database_name)
+                    )
+                ]
+                names = {table_name} | {alias for alias, target in aliases.items() if target[1] == table_name}
+                scans.append(
+                    {
+                        "database": database_name,
+                        "table": table_name,
+                        "estimated_rows": estimated_rows,
+                        "detail": detail,
+                        "columns": self._referenced_columns(sql, names, columns),
+                    }
+                )
+        suggested_indexes = []
+        async with self._lock:
+            schema_copy = await self._copy_schema()
+            for scan in scans:
+                equality, ranged, other = scan.pop("columns")
+                if not equality and not ranged:
+                    continue
+                index_columns = equality + ranged
+                # Make the index covering if it stays narrow enough, so the table itself needn't be read at all
+                if len(index_columns) + len(other) <= MAX_INDEX_COLUMNS:
+                    index_columns += other
+                index_columns = index_columns[:MAX_INDEX_COLUMNS]
+                index_name = f"{scan['table']}_{'_'.join(index_columns)}_index"
+                schema_prefix = "" if scan["database"] == "main" else f"{quote_identifier(scan['database'])}."
+                index_sql = (
+                    f"create index {schema_prefix}{quote_identifier(index_name)} on {quote_identifier(scan['table'])} "
+                    f"({', '.join(map(quote_identifier, index_columns))})"
+                )
+                drop_sql = f"drop index {schema_prefix}{quote_identifier(index_name)}"
+                try:
+                    plan_with_index = await anyio.to_thread.run_sync(
+                        self._try_index, schema_copy, index_sql, drop_sql, sql, parameters
+                    )
+                except sqlite3.Error as error:
+                    logging.debug(f"Could not try out index {index_sql}: {error}")
+                    continue
+                # Only suggest indexes that the planner would search rather than scan instead of the table
+                if any(index_name in detail and not detail.startswith("SCAN") for _, _, _, detail in plan_with_index):
+                    suggested_indexes.append(
+                        {
+                            "table": scan["table"],
+                            "sql": index_sql,
+                            "plan_with_index": self._format_plan(plan_with_index),
+                        }
+                    )
+        return {
+            "plan": self._format_plan(plan_rows),
+            "large_table_scans": scans,
+            "suggested_indexes": suggested_indexes,
+        }
+
+    @staticmethod
+    async def _estimate_rows(
+        sqlite_connection: aiosqlite.Connection, database_name: str, table_name: str
+    ) -> int | None:
+        """Estimate the rows of a table from sqlite_stat1 if ANALYZE filled it in, or else from its largest rowid."""
+        database = quote_identifier(database_name)
+        try:
+            stat_rows = await sqlite_connection.execute_fetchall(
+                f"select stat from {database}.sqlite_stat1 where tbl = ?", (table_name,)
+            )
+            for (stat,) in stat_rows:
+                if stat and stat.split()[0].isdigit():
+                    return int(stat.split()[0])
+        except sqlite3.OperationalError:
+            pass  # No sqlite_stat1 without ANALYZE
+        try:
+            max_rowid_rows = await sqlite_connection.execute_fetchall(
+                f"select max(_rowid_) from {database}.{quote_identifier(table_name)}"
+            )
+            return next(iter(max_rowid_rows))[0] or 0
+        except sqlite3.OperationalError:
+            return None  # WITHOUT ROWID table
+
+
+# Number of rowid ranges spread evenly over a table that a sample of it reads when it has no sample table
+SAMPLE_RANGES = 32
+# Identifier followed by any number of others after dots, like database.table.column
+_NAME_CHAIN = re.compile(rf"{_IDENTIFIER}(?:\s*\.\s*{_IDENTIFIER})*")
+# Start of a WITH clause, which more common table expressions can be put at the front of
+_WITH_CLAUSE = re.compile(r"\s*with(?:\s+recursive)?\s", re.IGNORECASE)
+
+
+class QuerySampler:
+    """Rewrites queries to read the `sample_table` of each table with a `sample_fraction`, or otherwise SAMPLE_RANGES
+    rowid ranges of it at pseudo-random offsets that stay the same until the data changes.
+    """
+
+    def __init__(self, pool: ConnectionPool, metadata: RootMetadata):
+        self.pool = pool
+        schemas = {PurePath(pool.sqlite_file).stem: "main"} | {stem: stem for stem in pool.attached_files}
+        self.sampled_tables: dict[tuple[str, str], TableMetadata] = {
+            (schemas[database_stem], table_name): table
+            for database_stem, database in metadata.databases.items()
+            if database_stem in schemas
+            for table_name, table in database.tables.items()
+            if table.sample_fraction
+        }
+        self._rowid_ranges: dict[tuple[str, str], tuple[list[tuple[int, int]], float]] = {}
+        self._data_version: tuple[int, ...] | None = None
+
+    def _resolve(self, table_reference: str) -> tuple[str, str] | None:
+        database_name, table_name = _split_qualified(table_reference)
+        # Unqualified names resolve to the main database first and then to attached ones, like in SQLite
+        for schema in [database_name] if database_name else ["main", *self.pool.attached_files]:
+            if (schema, table_name) in self.sampled_tables:
+                return schema, table_name
+        return None
+
+    async def _get_rowid_ranges(
+        self, schema: str, table_name: str, fraction: float
+    ) -> tuple[list[tuple[int, int]], float]:
+        """Return the rowid ranges to read of the table, and the fraction of its rowids that they cover."""
+        data_version = await self.pool.data_version()
+        if data_version != self._data_version:
+            self._rowid_ranges.clear()
+            self._data_version = data_version
+        if (schema, table_name) not in self._rowid_ranges:
+            async with self.pool.reader() as sqlite_connection:
+                cursor = await sqlite_connection.execute(
+                    f"select min(rowid), max(rowid) from {quote_identifier(schema)}.{quote_identifier(table_name)}"
+                )
+                low, high = await cursor.fetchone() or (None, None)
+            ranges = []
+            covered_fraction = fraction
+            if low is not None and high is not None:
+                span = high - low + 1
+                range_count = min(SAMPLE_RANGES, span)
+                stride = span / range_count
+                width = max(1, round(stride * fraction))
+                offsets = random.Random(f"{schema}.{table_name}")
+                for index in range(range_count):
+                    start = low + int(index * stride) + offsets.randrange(max(1, int(stride) - width + 1))
+                    ranges.append((start, min(start + width - 1, high)))
+                covered_fraction = sum(end - start + 1 for start, end in ranges) / span
+            self._rowid_ranges[(schema, table_name)] = (ranges, covered_fraction)
+        return self._rowid_ranges[(schema, table_name)]
+
+    async def rewrite(self, sql: str) -> tuple[str, str]:
+        """Return the SQL reading samples of its sampled tables instead, and a note on how to read its results.
+        Each sampled table is shadowed by a common table expression of the same name, so the query itself is unchanged
+        apart from database names qualifying the table, and its columns keep their names.
+        """
+        common_table_names: dict[tuple[str, str], str] = {}
+        replacements = []
+        # Look for tables in the SQL without its literals and comments, which may mention them without reading them
+        masked_sql = mask_literals_and_comments(sql)
+        for match in _NAME_CHAIN.finditer(masked_sql):
+            parts = list(re.finditer(_IDENTIFIER, match.group()))
+            names = [_unquote(part.group()) for part in parts[:2]]
+            if len(parts) > 1 and (names[0], names[1]) in self.sampled_tables:
+                resolved = (names[0], names[1])
+                # Like database.table or database.table.column, which would bypass the common table expression
+                replacements.append((match.start() + parts[0].start(), match.start() + parts[1].end(), resolved))
+            elif len(parts) == 1 and not masked_sql[match.end() :].lstrip().startswith("("):
+                resolved = self._resolve(parts[0].group())
+            else:
+                resolved = None
+            if resolved is not None:
+                schema, table_name = resolved
+                unqualified = self._resolve(quote_identifier(table_name)) == resolved
+                common_table_names[resolved] = quote_identifier(table_name if unqualified else f"{schema}.{table_name}")
+        if not common_table_names:
+            sampled_names = ", ".join(
+                table_name if schema == "main" else f"{schema}.{table_name}"
+                for schema, table_name in self.sampled_tables
+            )
+            raise ValueError(f"The query doesn't read any of the tables that can be sampled: {sampled_names}.")
+        for start, end, resolved in reversed(replacements):
+            sql = sql[:start] + common_table_names[resolved] + sql[end:]
+        common_tables = []
+        sampled_fractions: dict[tuple[str, str], tuple[str, float]] = {}
+        for (schema, table_name), common_table_name in common_table_names.items():
+            table = self.sampled_tables[(schema, table_name)]
+            fraction = table.sample_fraction or 1
+            if table.sample_table:
+                source = f"{quote_identifier(schema)}.{quote_identifier(table.sample_table)}"
+                sampled_fractions[(schema, table_name)] = (f"its sample table {table.sample_table}", fraction)
+            else:
+                ranges, fraction = await self._get_rowid_ranges(schema, table_name, fraction)
+                condition = " or ".join(f"rowid between {start} and {end}" for start, end in ranges) or "0"
+                source = f"{quote_identifier(schema)}.{quote_identifier(table_name)} where {condition}"
+                sampled_fractions[(schema, table_name)] = (
+                    f"{len(ranges)} evenly spread ranges of its rowids",
+                    fraction,
+                )
+            common_tables.append(f"{common_table_name} as (select * from {source})")
+        with_clause = _WITH_CLAUSE.match(masked_sql)
+        if with_clause:
+            sql = f"{sql[: with_clause.end()]}{', '.join(common_tables)}, {sql[with_clause.end() :]}"
+        else:
+            sql = f"with {', '.join(common_tables)} {sql}"
+        sampled_descriptions = "; ".join(
+            f"{table_name} through {source} ({fraction:.3%} of its rows)"
+            for (_, table_name), (source, fraction) in sampled_fractions.items()
+        )
+        scale = 1 / math.prod(fraction for _, fraction in sampled_fractions.values())
+        note = (
+            f"\nSampled: these results only read a sample of {sampled_descriptions}. "
+            f"Averages, ratios, minimums and maximums estimate the full data as they are, but counts and sums "
+            f"estimate it multiplied by {scale:,.4g}. "
+        )
+        if any(not self.sampled_tables[resolved].sample_table for resolved in common_table_names):
+            note += (
+                "Rowid ranges are read as contiguous blocks of rows rather than rows picked one by one, so where "
+                "values cluster by rowid (e.g. by when rows were inserted) estimates vary more than from a random "
+                "sample. "
+            )
+        note += "Rare values may be missing altogether. Leave out sample for exact results."
+        return sql, note
+
+
+class CallStats:
+    """What a single tool call did, filled in while it runs and recorded in ServerMetrics once it's done."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.sql: str | None = None
+        self.parameters: dict[str, str] = {}
+        self.rows = 0
+        self.cache_hit = False
+
+
+# Maximum number of distinct scan patterns recorded, beyond which new patterns are ignored
+MAX_SCAN_PATTERNS = 1000
+
+# Upper bounds in seconds of the buckets of the tool latency histograms, followed by an unbounded bucket
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class ToolMetrics:
+    """Counters and latency histogram of the calls to one tool."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float, call_stats: CallStats, output_bytes: int, error: bool) -> None:
+        self.calls += 1
+        self.errors += error
+        self.seconds += seconds
+        self.rows += call_stats.rows
+        self.bytes += output_bytes
+        self.cache_hits += call_stats.cache_hit
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 6),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "cache_hits": self.cache_hits,
+            "latency_buckets": {
+                str(bound): count for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.buckets, strict=True)
+            },
+        }
+
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ServerMetrics:
+    """Per-tool metrics of the server, and a log of the slowest recent queries along with their query plans."""
+
+    def __init__(self, slow_query_seconds: float = 1, slow_query_log_size: int = 100):
+        self.slow_query_seconds = slow_query_seconds
+        self.tools: dict[str, ToolMetrics] = {}
+        self.slow_queries: deque[dict[str, Any]] = deque(maxlen=slow_query_log_size)
+        self.slow_query_count = 0
+        # (database, table, suggested index or None) -> scans of the table seen, with an example query
+        self.scan_patterns: dict[tuple[str, str, str | None], dict[str, Any]] = {}
+
+    def observe(self, seconds: float, call_stats: CallStats, output_bytes: int, error: bool = False) -> bool:
+        """Record a finished tool call. Returns whether it ran a query slow enough to go in the slow query log."""
+        self.tools.setdefault(call_stats.tool, ToolMetrics()).observe(seconds, call_stats, output_bytes, error)
+        return bool(self.slow_query_seconds and call_stats.sql is not None and seconds >= self.slow_query_seconds)
+
+    async def log_slow_query(self, pool: ConnectionPool, call_stats: CallStats, seconds: float) -> None:
+        assert call_stats.sql is not None
+        try:
+            async with pool.reader() as sqlite_connection:
+                plan = [
+                    detail
+                    for _, _, _, detail in await sqlite_connection.execute_fetchall(
+                        f"explain query plan {call_stats.sql}", call_stats.parameters
+                    )
+                ]
+        except sqlite3.Error as error:
+            plan = [f"Query plan unavailable: {error}"]
+        logging.warning(f"Slow query in {call_stats.tool} ({seconds:.3f}s): {call_stats.sql}\n" + "\n".join(plan))
+        self.slow_query_count += 1
+        self.slow_queries.append(
+            {
+                "tool": call_stats.tool,
+                "sql": call_stats.sql,
+                "seconds": round(seconds, 6),
+                "rows": call_stats.rows,
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "query_plan": plan,
+            }
+        )
+
+    def record_scans(self, sql: str, analysis: dict[str, Any]) -> None:
+        """Count the scans of large tables in an analysis from QueryPlanAnalyzer, grouped by the suggested index."""
+        suggested_indexes = {suggestion["table"]: suggestion["sql"] for suggestion in analysis["suggested_indexes"]}
+        for scan in analysis["large_table_scans"]:
+            pattern_key = (scan["database"], scan["table"], suggested_indexes.get(scan["table"]))
+            if pattern_key not in self.scan_patterns:
+                if len(self.scan_patterns) >= MAX_SCAN_PATTERNS:
+                    continue
+                self.scan_patterns[pattern_key] = {
+                    "database": scan["database"],
+                    "table": scan["table"],
+                    "suggested_index": pattern_key[2],
+                    "count": 0,
+                    "example_sql": sql,
+                }
+            self.scan_patterns[pattern_key]["count"] += 1
+            self.scan_patterns[pattern_key]["estimated_rows"] = scan["estimated_rows"]
+
+    def snapshot(self, pool: ConnectionPool, result_cache: "ResultCache") -> dict[str, Any]:
+        return {
+            "tools": {tool: tool_metrics.to_dict() for tool, tool_metrics in sorted(self.tools.items())},
+            "result_cache": result_cache.stats(),
+            "queue": {
+                "queued": dict(pool.queued),
+                "wait_seconds": {kind: round(seconds, 6) for kind, seconds in pool.queue_wait_seconds.items()},
+            },
+            "slow_query_count": self.slow_query_count,
+            "slow_queries": list(self.slow_queries),
+            "scan_patterns": sorted(self.scan_patterns.values(), key=lambda pattern: -pattern["count"]),
+        }
+
+    @staticmethod
+    def to_prometheus(snapshot: dict[str, Any]) -> str:
+        """Render a snapshot in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE mcp_sqlite_tool_latency_seconds histogram",
+        ]
+        for tool, tool_metrics in snapshot["tools"].items():
+            label = f'tool="{_prometheus_label(tool)}"'
+            cumulative = 0
+            for bound, count in tool_metrics["latency_buckets"].items():
+                cumulative += count
+                lines.append(f'mcp_sqlite_tool_latency_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"mcp_sqlite_tool_latency_seconds_sum{{{label}}} {tool_metrics['seconds']}")
+            lines.append(f"mcp_sqlite_tool_latency_seconds_count{{{label}}} {tool_metrics['calls']}")
+        for counter in ("errors", "rows", "bytes", "cache_hits"):
+            lines.append(f"# TYPE mcp_sqlite_tool_{counter}_total counter")
+            for tool, tool_metrics in snapshot["tools"].items():
+                lines.append(
+                    f'mcp_sqlite_tool_{counter}_total{{tool="{_prometheus_label(tool)}"}} {tool_metrics[counter]}'
+                )
+        lines.append("# TYPE mcp_sqlite_result_cache_hits_total counter")
+        lines.append(f"mcp_sqlite_result_cache_hits_total {snapshot['result_cache']['hits']}")
+        lines.append("# TYPE mcp_sqlite_result_cache_misses_total counter")
+        lines.append(f"mcp_sqlite_result_cache_misses_total {snapshot['result_cache']['misses']}")
+        lines.append("# TYPE mcp_sqlite_queued gauge")
+        for kind, queued in snapshot["queue"]["queued"].items():
+            lines.append(f'mcp_sqlite_queued{{kind="{kind}"}} {queued}')
+        lines.append("# TYPE mcp_sqlite_queue_wait_seconds_total counter")
+        for kind, seconds in snapshot["queue"]["wait_seconds"].items():
+            lines.append(f'mcp_sqlite_queue_wait_seconds_total{{kind="{kind}"}} {seconds}')
+        lines.append("# TYPE mcp_sqlite_slow_queries_total counter")
+        lines.append(f"mcp_sqlite_slow_queries_total {snapshot['slow_query_count']}")
+        lines.append("# TYPE mcp_sqlite_large_table_scans_total counter")
+        for pattern in snapshot["scan_patterns"]:
+            labels = (
+                f'database="{_prometheus_label(pattern["database"])}",table="{_prometheus_label(pattern["table"])}",'
+                f'suggested_index="{_prometheus_label(pattern["suggested_index"] or "")}"'
+            )
+            lines.append(f"mcp_sqlite_large_table_scans_total{{{labels}}} {pattern['count']}")
+        return "\n".join(lines) + "\n"
+
+
+async def dump_metrics(
+    metrics: ServerMetrics, pool: ConnectionPool, result_cache: "ResultCache", metrics_file: str, interval: float
+) -> None:
+    """Write a snapshot of the metrics to `metrics_file` every `interval` seconds, in the Prometheus text format if the
+    file name ends in .prom or .txt and as JSON otherwise. Each snapshot atomically replaces the previous one.
+    """
+    while True:
+        await anyio.sleep(interval)
+        snapshot = metrics.snapshot(pool, result_cache)
+        if metrics_file.endswith((".prom", ".txt")):
+            text = ServerMetrics.to_prometheus(snapshot)
+        else:
+            text = json.dumps(snapshot, indent=2)
+        temporary_file = f"{metrics_file}.tmp"
+        await anyio.Path(temporary_file).write_text(text)
+        os.replace(temporary_file, metrics_file)
+
+
+class _OpenResult:
+    def __init__(
+        self,
+        connection: aiosqlite.Connection | None,
+        result_rows: ResultRows | None,
+        query_key: tuple,
+        expires_at: float,
+    ):
+        self.connection = connection
+        self.result_rows = result_rows
+        self.query_key = query_key
+        self.expires_at = expires_at
+        # Rows returned by the pages so far, skipped when the query has to be run again
+        self.rows_read = 0
+
+
+class Paginator:
+    """Paginated results still being read, each kept as an open cursor on its own connection until its last page."""
+
+    def __init__(self, pool: ConnectionPool, max_open: int = 8, ttl: float = 300):
+        self.pool = pool
+        self.max_open = max_open
+        self.ttl = ttl
+        self._open_results: dict[str, _OpenResult] = {}
+        pool.before_write.append(self.close_cursors)
+
+    async def _close_cursor(self, open_result: _OpenResult) -> None:
+        if open_result.connection is not None:
+            connection, open_result.connection, open_result.result_rows = open_result.connection, None, None
+            await self.pool.close_dedicated(connection)
+
+    async def close_cursors(self) -> None:
+        """Close the cursors of the results in between pages, whose read transactions would keep writes from committing.
+        The next page of each such result runs its query again and skips the rows already returned.
+        """
+        for open_result in list(self._open_results.values()):
+            await self._close_cursor(open_result)
+
+    async def _discard(self, next_token: str) -> None:
+        await self._close_cursor(self._open_results.pop(next_token))
+
+    async def _discard_expired(self) -> None:
+        now = time.monotonic()
+        for next_token in [token for token, result in self._open_results.items() if result.expires_at <= now]:
+            await self._discard(next_token)
+        # Dicts keep insertion order, so the first open results are the least recently used
+        while len(self._open_results) >= self.max_open:
+            await self._discard(next(iter(self._open_results)))
+
+    async def page(
+        self,
+        sql: str,
+        parameters: dict[str, str],
+        page_size: int,
+        next_token: str | None = None,
+        max_bytes: int = 0,
+        result_format: str = "html",
+        timeout: float = 0,
+        max_steps: int = 0,
+        call_stats: "CallStats | None" = None,
+    ) -> str:
+        if page_size < 1:
+            raise ValueError(f"page_size must be a positive integer, got {page_size}.")
+        serializer = get_result_format(result_format)
+        await self._discard_expired()
+        query_key = (sql, tuple(sorted(parameters.items())))
+        if next_token is None:
+            open_result = _OpenResult(None, None, query_key, 0)
+        else:
+            open_result = self._open_results.pop(next_token, None)
+            if open_result is None:
+                raise ValueError("Unknown or expired next_token. Call the tool again without next_token to restart.")
+            if open_result.query_key != query_key:
+                await self._close_cursor(open_result)
+                raise ValueError("next_token was issued for a different query or different parameters.")
+        rerun = next_token is not None and open_result.connection is None
+        if open_result.connection is None:
+            open_result.connection = await self.pool.open_dedicated()
+        try:
+            async with (
+                self.pool.reader_slot(),
+                query_budget(open_result.connection, timeout=timeout, max_steps=max_steps),
+            ):
+                if open_result.result_rows is None:
+                    cursor = await open_result.connection.execute(sql, parameters)
+                    if not cursor.description:
+                        await self._close_cursor(open_result)
+                        return "Statement executed successfully"
+                    open_result.result_rows = ResultRows(cursor)
+                    skipped_rows = 0
+                    while skipped_rows < open_result.rows_read:
+                        rows = await open_result.result_rows.take(min(FETCH_SIZE, open_result.rows_read - skipped_rows))
+                        if not rows:
+                            break
+                        skipped_rows += len(rows)
+                result_text, row_count, limit = await render_results(
+                    open_result.result_rows, serializer, max_rows=page_size, max_bytes=max_bytes
+                )
+            if limit and row_count == 0:
+                raise ValueError(f"A single row of the result exceeds {limit}. Select fewer or narrower columns.")
+        except BaseException:
+            await self._close_cursor(open_result)
+            raise
+        open_result.rows_read += row_count
+        if call_stats is not None:
+            call_stats.rows += row_count
+        if rerun:
+            first_row = open_result.rows_read - row_count + 1
+            result_text += (
+                f"\nThe data was written to since the previous page, so this page is rows {first_row} to "
+                f"{open_result.rows_read} of the query run again, which may skip or repeat rows that changed."
+            )
+        if not limit:
+            await self._close_cursor(open_result)
+            return result_text
+        next_token = secrets.token_urlsafe(16)
+        open_result.expires_at = time.monotonic() + self.ttl
+        self._open_results[next_token] = open_result
+        return (
+            f'{result_text}\nMore rows are available. Call this tool again with the same arguments and next_token "'
+            f'{next_token}" to get the next page.'
+        )
+
+
+# Maximum number of distinct sets of parameters of one canned query whose results are kept materialized
+MAX_MATERIALIZED_VARIANTS = 64
+
+
+class _Materialization:
+    def __init__(self, sql: str, parameters: dict[str, Any]):
+        self.sql = sql
+        self.parameters = parameters
+        self.table: str | None = None
+        self.previous_table: str | None = None
+        self.columns: list[str] = []
+        self.rows = 0
+        self.computed_at: float | None = None
+        self.seconds = 0.0
+        self.data_version: tuple[int, ...] | None = None
+        self.lock = anyio.Lock()
+
+
+class MaterializedQueries:
+    """Results of canned queries marked `materialized: true`, kept in tables of a temporary cache database in WAL mode
+    and recomputed every `refresh_seconds`, or otherwise on the first call after the data changed.
+    """
+
+    def __init__(self, pool: ConnectionPool, timeout: float = 0, max_steps: int = 0):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self._cache_directory: tempfile.TemporaryDirectory | None = None
+        self._cache_pool: ConnectionPool | None = None
+        self._materializations: dict[tuple[str, str], _Materialization] = {}
+        self._table_count = 0
+
+    def _get_cache_pool(self) -> ConnectionPool:
+        if self._cache_pool is None:
+            self._cache_directory = tempfile.TemporaryDirectory(prefix="mcp_sqlite_")
+            # Not attached to the served files' connections, where refreshes would bump their schema version and the
+            # cache tables would show up in the catalog
+            cache_file = os.path.join(self._cache_directory.name, "materialized.db")
+            # An empty file is an empty database, which the writer connection can then open without creating it
+            Path(cache_file).touch()
+            self._cache_pool = ConnectionPool(
+                cache_file, size=self.pool.size, writer_pragmas=["journal_mode = wal", "synchronous = off"]
+            )
+        return self._cache_pool
+
+    async def _refresh(self, materialization: _Materialization) -> None:
+        cache_pool = self._get_cache_pool()
+        # Taken before running the query, so that changes made while it runs are caught by the next check
+        data_version = await self.pool.data_version()
+        started_at = time.perf_counter()
+        self._table_count += 1
+        table = f"result_{self._table_count}"
+        async with self.pool.reader() as sqlite_connection, cache_pool.writer() as cache_connection:
+            async with query_budget(sqlite_connection, timeout=self.timeout, max_steps=self.max_steps):
+                cursor = await sqlite_connection.execute(materialization.sql, materialization.parameters)
+                columns = [column_description[0] for column_description in cursor.description or []]
+                if not columns:
+                    raise ValueError("Only queries that return rows can be materialized.")
+                # Positional column names, as the names of result columns needn't be unique
+                column_names = [f"c{index}" for index in range(len(columns))]
+                await cache_connection.execute(f"create table {table} ({', '.join(column_names)})")
+                insert_sql = f"insert into {table} values ({', '.join('?' * len(columns))})"
+                row_count = 0
+                while rows := list(await cursor.fetchmany(EXPORT_FETCH_SIZE)):
+                    await cache_connection.executemany(insert_sql, rows)
+                    row_count += len(rows)
+                await cursor.close()
+            # The table replaced by the previous refresh is only dropped now, so that calls reading it could finish
+            if materialization.previous_table is not None:
+                await cache_connection.execute(f"drop table {materialization.previous_table}")
+        materialization.previous_table, materialization.table = materialization.table, table
+        materialization.columns = columns
+        materialization.rows = row_count
+        materialization.data_version = data_version
+        materialization.computed_at = time.time()
+        materialization.seconds = time.perf_counter() - started_at
+        logging.info(f"Materialized {row_count} rows in {materialization.seconds:.2f}s: {materialization.sql}")
+
+    async def get(self, query_slug: str, query: QueryMetadata, parameters: dict[str, Any]) -> _Materialization | None:
+        """Return the up-to-date materialized results of the canned query with the parameters, computing them if
+        needed, or None if the query already has as many materialized sets of parameters as it can.
+        """
+        key = (query_slug, json.dumps(parameters, sort_keys=True, default=str))
+        materialization = self._materializations.get(key)
+        if materialization is None:
+            if sum(slug == query_slug for slug, _ in self._materializations) >= MAX_MATERIALIZED_VARIANTS:
+                return None
+            materialization = self._materializations[key] = _Materialization(query.sql, parameters)
+        async with materialization.lock:
+            if materialization.table is None or (
+                not query.refresh_seconds and materialization.data_version != await self.pool.data_version()
+            ):
+                await self._refresh(materialization)
+        return materialization
+
+    async def serve(
+        self,
+        query_slug: str,
+        query: QueryMetadata,
+        parameters: dict[str, Any],
+        max_rows: int = 0,
+        max_bytes: int = 0,
+        result_format: str = "html",
+        call_stats: "CallStats | None" = None,
+    ) -> str | None:
+        """Serialize the materialized results of the canned query like execute() would, followed by a note on how
+        fresh they are, or return None if they can't be materialized.
+        """
+        materialization = await self.get(query_slug, query, parameters)
+        if materialization is None or materialization.table is None or materialization.computed_at is None:
+            return None
+        select_list = ", ".join(
+            f"c{index} as {quote_identifier(column)}" for index, column in enumerate(materialization.columns)
+        )
+        result_text = await execute(
+            self._get_cache_pool(),
+            f"select {select_list} from {materialization.table} order by rowid",
+            max_rows=max_rows,
+            max_bytes=max_bytes,
+            result_format=result_format,
+            call_stats=call_stats,
+        )
+        computed_at = datetime.fromtimestamp(materialization.computed_at, timezone.utc)
+        age = time.time() - materialization.computed_at
+        note = (
+            f"\nMaterialized: precomputed {age:.0f} seconds ago at {computed_at.isoformat(timespec='seconds')} "
+            f"in {materialization.seconds:.2f} seconds"
+        )
+        if query.refresh_seconds:
+            note += f", recomputed every {query.refresh_seconds:g} seconds"
+            if materialization.data_version != await self.pool.data_version():
+                note += ". The data changed since, so these results may be stale"
+        else:
+            note += ", recomputed whenever the data changes"
+        return result_text + note + "."
+
+    async def refresh_periodically(self, query_slug: str, query: QueryMetadata) -> None:
+        """Recompute every materialized set of parameters of the canned query every `refresh_seconds` seconds."""
+        while True:
+            await anyio.sleep(query.refresh_seconds or 0)
+            for (slug, _), materialization in list(self._materializations.items()):
+                if slug != query_slug:
+                    continue
+                try:
+                    async with materialization.lock:
+                        await self._refresh(materialization)
+                except (sqlite3.Error, QueryInterruptedError, PoolBusyError) as error:
+                    logging.warning(f"Could not refresh the materialized results of '{query_slug}': {error}")
+
+    async def close(self) -> None:
+        if self._cache_pool is not None:
+            await self._cache_pool.close()
+            self._cache_pool = None
+        if self._cache_directory is not None:
+            self._cache_directory.cleanup()
+            self._cache_directory = None
+
+    async def __aenter__(self) -> "MaterializedQueries":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+# Tool argument choosing the serialization of results, accepted by sqlite_execute and canned queries
+FORMAT_PROPERTIES = {
+    "format": {
+        "type": "string",
+        "enum": list(RESULT_FORMATS),
+        "description": "Format of the results. Defaults to the server's configured format.",
+    },
+}
+
+# Tool arguments for reading results page by page, accepted by sqlite_execute and read-only canned queries
+PAGINATION_PROPERTIES = {
+    "page_size": {
+        "type": "integer",
+        "minimum": 1,
+        "description": "Return at most this many rows, with a next_token to get the following page if more remain.",
+    },
+    "next_token": {
+        "type": "string",
+        "description": "Token returned with the previous page. Pass it with otherwise unchanged arguments.",
+    },
+}
+
+
+# Description of the argument of write canned queries taking many parameter sets, each shaped like the single one
+BULK_WRITE_DESCRIPTION = (
+    "Parameter sets to write in bulk in one call, each an object with every parameter of the query, instead of the "
+    "single set of parameters. Much faster than one call per set."
+)
+
+# Statements returning rows, whose results a group commit would have to discard
+RETURNING_PATTERN = re.compile(r"\breturning\b", re.IGNORECASE)
+
+
+def canned_query_options(query_params: Sequence[str], write: bool = False) -> dict[str, Any]:
+    """Return the tool arguments that control how a canned query runs, rather than binding its parameters. Any of them
+    named like a parameter of the query is left out, so that metadata written for Datasette keeps working as it is.
+    """
+    options = {key: value for key, value in FORMAT_PROPERTIES.items() if key not in query_params}
+    if not write and not set(PAGINATION_PROPERTIES) & set(query_params):
+        options |= PAGINATION_PROPERTIES
+    if write and "rows" not in query_params:
+        options["rows"] = {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {param: {"type": "string"} for param in query_params},
+                "required": list(query_params),
+            },
+            "description": BULK_WRITE_DESCRIPTION,
+        }
+    return options
+
+
+# Version of the layout of snapshot files, to be bumped whenever it changes
+SNAPSHOT_FORMAT = 1
+
+
+class Snapshot(BaseModel):
+    """Metadata and catalog compiled ahead of time with --compile-snapshot. The metadata stays valid as long as the
+    metadata file has the same hash, and the catalog as long as the files being served have the same schema versions.
+    """
+
+    format: int = SNAPSHOT_FORMAT
+    sqlite_files: list[str]
+    metadata_sha256: str | None
+    schema_version: list[int]
+    metadata: dict[str, Any]
+    catalog_json: str
+
+
+def read_metadata_file(metadata_yaml_file: str | None) -> tuple[dict[str, Any], str | None]:
+    """Return the parsed metadata file (YAML or JSON) along with the SHA-256 hash of its contents."""
+    if not metadata_yaml_file:
+        return {}, None
+    # Imported here so that servers without a metadata file, or with a valid snapshot, don't pay for it at startup
+    import yaml
+
+    with open(metadata_yaml_file, "rb") as metadata_file_descriptor:
+        metadata_bytes = metadata_file_descriptor.read()
+    return yaml.safe_load(metadata_bytes) or {}, hashlib.sha256(metadata_bytes).hexdigest()
+
+
+def file_hash(path: str | None) -> str | None:
+    if not path:
+        return None
+    with open(path, "rb") as file_descriptor:
+        return hashlib.file_digest(file_descriptor, "sha256").hexdigest()
+
+
+def read_snapshot(snapshot_file: str, sqlite_files: Sequence[str], metadata_yaml_file: str | None) -> Snapshot | None:
+    """Return the snapshot if it was compiled for the same files and metadata, or else None."""
+    try:
+        with open(snapshot_file, "rb") as snapshot_file_descriptor:
+            snapshot = Snapshot.model_validate_json(snapshot_file_descriptor.read())
+    except (OSError, ValueError) as error:
+        logging.info(f"Not using snapshot {snapshot_file}: {error}")
+        return None
+    if snapshot.format != SNAPSHOT_FORMAT:
+        logging.info(f"Not using snapshot {snapshot_file}, as it has the outdated format {snapshot.format}")
+    elif snapshot.sqlite_files != [os.path.abspath(sqlite_file) for sqlite_file in sqlite_files]:
+        logging.info(f"Not using snapshot {snapshot_file}, as it was compiled for other files")
+    elif snapshot.metadata_sha256 != file_hash(metadata_yaml_file):
+        logging.info(f"Not using snapshot {snapshot_file}, as the metadata file changed")
+    else:
+        return snapshot
+    return None
+
+
+async def compile_snapshot(
+    sqlite_file: str | Sequence[str], metadata_yaml_file: str | None, snapshot_file: str
+) -> Snapshot:
+    """Parse the metadata file and introspect the files being served into a snapshot written to `snapshot_file`."""
+    sqlite_files = [sqlite_file] if isinstance(sqlite_file, str) else list(sqlite_file)
+    metadata_dict, metadata_sha256 = read_metadata_file(metadata_yaml_file)
+    async with ConnectionPool(sqlite_files[0], size=1, attach_files=sqlite_files[1:]) as pool:
+        catalog = await get_catalog(pool, RootMetadata(**metadata_dict))
+        schema_version = await get_schema_version(pool)
+    snapshot = Snapshot(
+        sqlite_files=[os.path.abspath(sqlite_file) for sqlite_file in sqlite_files],
+        metadata_sha256=metadata_sha256,
+        schema_version=list(schema_version),
+        metadata=metadata_dict,
+        catalog_json=catalog.model_dump_json(exclude_none=True),
+    )
+    # Replace any previous snapshot atomically, so that a server starting meanwhile never reads half of one
+    temporary_file = f"{snapshot_file}.tmp"
+    await anyio.Path(temporary_file).write_text(snapshot.model_dump_json())
+    os.replace(temporary_file, snapshot_file)
+    logging.info(f"Compiled snapshot {snapshot_file} for schema version {schema_version}")
+    return snapshot
 
 
-class RootMetadata(BaseModel):
-    databases: dict[str, DatabaseMetadata] = {}
-    model_config = {
-        "extra": "allow",
-    }
+# Schema of each query of a batch, either SQL or a read-only canned query with its parameters
+BATCH_QUERY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sql": {
+            "type": "string",
+            "description": "SQL to execute, like with sqlite_execute.",
+        },
+        "query": {
+            "type": "string",
+            "description": "Name of a read-only canned query to execute instead of SQL.",
+        },
+        "parameters": {
+            "type": "object",
+            "description": "Parameters of the canned query.",
+            "additionalProperties": {"type": "string"},
+        },
+    },
+}
 
+# Maximum number of queries in one batch
+MAX_BATCH_QUERIES = 50
+# Statements that start or end transactions, which would end the snapshot that the queries of a batch share
+TRANSACTION_CONTROL = re.compile(r"\s*(begin|commit|end|rollback|savepoint|release)\b", re.IGNORECASE)
 
-async def get_catalog(sqlite_file: str, metadata: RootMetadata) -> RootMetadata:
-    # Copy all metadata except databases
-    catalog = RootMetadata(**{key: value for key, value in metadata if key != "databases"})
-    async with aiosqlite.connect(f"file:{sqlite_file}?mode=ro", uri=True) as sqlite_connection:
-        # Get the true database names and stems of their filepaths
-        cursor = await sqlite_connection.execute("pragma database_list")
-        for database_name, database_stem in [
-            (database_row[1], PurePath(database_row[2]).stem) for database_row in await cursor.fetchall()
-        ]:
-            database_in_metadata = database_stem in metadata.databases
-            # Rename from the stem to the true SQLite-internal name (usually "main")
-            database = DatabaseMetadata(
-                **(
-                    {key: value for key, value in metadata.databases[database_stem] if key != "tables"}
-                    if database_in_metadata
-                    else {}
-                )
-            )
-            # Set the default title for the database if not provided
-            if not database.title:
-                database.title = database_stem
-            # Get the table names
-            cursor = await sqlite_connection.execute(f"pragma {database_name}.table_list")
-            for table_name in [
-                table_row[1] for table_row in await cursor.fetchall() if not table_row[1].startswith("sqlite_")
-            ]:
-                table_in_metadata = database_in_metadata and table_name in metadata.databases[database_stem].tables
-                table = TableMetadata(
-                    **(
-                        {
-                            key: value
-                            for key, value in metadata.databases[database_stem].tables[table_name]
-                            if key != "columns"
-                        }
-                        if table_in_metadata
-                        else {}
-                    )
-                )
-                # Omit hidden tables
-                if table.hidden:
-                    continue
-                # Get the column names
-                cursor = await sqlite_connection.execute(f"pragma {database_name}.table_info({table_name})")
-                for column_name in [column_row[1] for column_row in await cursor.fetchall()]:
-                    column_in_metadata = (
-                        table_in_metadata
-                        and column_name in metadata.databases[database_stem].tables[table_name].columns
-                    )
-                    column_description = (
-                        metadata.databases[database_stem].tables[table_name].columns[column_name]
-                        if column_in_metadata
-                        else ""
-                    )
-                    table.columns[column_name] = column_description
-                database.tables[table_name] = table
-            catalog.databases[database_name] = database
-        return catalog
+# Size of the statement cache of each connection before accounting for canned queries, same as the sqlite3 default
+DEFAULT_CACHED_STATEMENTS = 128
 
 
-async def execute(sqlite_file: str, sql: str, parameters: dict[str, str] = {}, write: bool = False) -> str:
-    async with aiosqlite.connect(f"file:{sqlite_file}?mode={'rw' if write else 'ro'}", uri=True) as sqlite_connection:
-        cursor = await sqlite_connection.execute(sql, parameters)
-        if not cursor.description:
-            return "Statement executed successfully"
-        header_inner_html = ""
-        for column_description in cursor.description:
-            header_inner_html += f"<th>{html.escape(column_description[0])}</th>"
-        rows_html = f"<tr>{header_inner_html}</tr>"
-        for row in await cursor.fetchall():
-            row_inner_html = ""
-            for value in row:
-                row_inner_html += f"<td>{html.escape(str(value))}</td>"
-            rows_html += f"<tr>{row_inner_html}</tr>"
-        return f"<table>{rows_html}</table>"
-
-
-async def mcp_sqlite_server(sqlite_file: str, metadata: RootMetadata = RootMetadata(), prefix: str = "") -> Server:
+@asynccontextmanager
+async def mcp_sqlite_server(
+    sqlite_file: str,
+    metadata: RootMetadata = RootMetadata(),
+    prefix: str = "",
+    settings: ServerSettings = ServerSettings(),
+    attach_files: Sequence[str] = (),
+    snapshot: Snapshot | None = None,
+) -> AsyncIterator[Server]:
     """Create a catalog of databases, tables, and columns that are actually in the connection, enriched with optional metadata.
-    All kwargs go to aiosqlite.connect()
+    The server owns a pool of read-only connections and one writer connection, closed when the context exits.
+    The catalog of `snapshot` is used instead of introspecting the files if their schema versions still match.
     """
+    # Leave room in each connection's statement cache for every canned query next to ad hoc SQL
+    canned_query_count = sum(len(database.queries) for database in metadata.databases.values())
+    async with (
+        ConnectionPool(
+            sqlite_file,
+            size=settings.pool_size,
+            cached_statements=DEFAULT_CACHED_STATEMENTS + canned_query_count,
+            max_queued=settings.max_queued,
+            attach_files=attach_files,
+            reader_pragmas=settings.reader_pragmas(),
+            immutable=settings.immutable,
+            writer_pragmas=settings.writer_pragmas(),
+        ) as pool,
+        MaterializedQueries(pool, timeout=settings.query_timeout, max_steps=settings.max_steps) as materialized,
+        anyio.create_task_group() as task_group,
+    ):
+        try:
+            yield await _create_server(
+                pool,
+                metadata=metadata,
+                prefix=prefix,
+                settings=settings,
+                task_group=task_group,
+                snapshot=snapshot,
+                materialized=materialized,
+            )
+        finally:
+            task_group.cancel_scope.cancel()
+
+
+async def _warm_catalog(catalog_cache: CatalogCache):
+    """Build the catalog in the background right after startup, so that it's usually ready by the first call to it."""
+    try:
+        await catalog_cache.get()
+    except sqlite3.Error as error:
+        logging.warning(f"Could not build the catalog: {error}")
+
+
+async def _warm_enriched_catalog(pool: ConnectionPool, catalog_cache: CatalogCache, analyze: bool = False):
+    """Build the enriched catalog ahead of the first call to it, after gathering table statistics if asked to."""
+    if analyze:
+        try:
+            async with pool.writer() as sqlite_connection:
+                await sqlite_connection.execute("analyze")
+        except sqlite3.Error as error:
+            logging.warning(f"Could not analyze the databases: {error}")
+    try:
+        await catalog_cache.get_enriched()
+    except sqlite3.Error as error:
+        logging.warning(f"Could not build the enriched catalog: {error}")
+
+
+async def _warm_materialized(materialized: MaterializedQueries, query_slug: str, query: QueryMetadata):
+    """Materialize the results of a canned query without parameters in the background right after startup."""
+    try:
+        await materialized.get(query_slug, query, {})
+    except (sqlite3.Error, QueryInterruptedError, ValueError) as error:
+        logging.warning(f"Could not materialize the results of '{query_slug}': {error}")
+
+
+async def _create_server(
+    pool: ConnectionPool,
+    metadata: RootMetadata,
+    prefix: str,
+    settings: ServerSettings,
+    task_group: TaskGroup | None = None,
+    snapshot: Snapshot | None = None,
+    materialized: MaterializedQueries | None = None,
+) -> Server:
     server = Server("mcp-sqlite")
-    initial_catalog = await get_catalog(sqlite_file=sqlite_file, metadata=metadata)
+    catalog_cache = CatalogCache(
+        pool=pool, metadata=metadata, sample_rows=settings.stats_sample_rows, timeout=settings.query_timeout
+    )
+    paginator = Paginator(pool, max_open=settings.max_open_pages, ttl=settings.page_ttl)
+    result_cache = ResultCache(
+        max_entries=settings.result_cache_size, max_bytes=settings.result_cache_bytes, ttl=settings.result_cache_ttl
+    )
+    metrics = ServerMetrics(slow_query_seconds=settings.slow_query_seconds)
+    plan_analyzer = QueryPlanAnalyzer(pool, large_table_rows=settings.large_table_rows)
+    sampler = QuerySampler(pool, metadata)
+    if settings.export_dir:
+        os.makedirs(settings.export_dir, exist_ok=True)
+    group_committer = (
+        GroupCommitter(
+            pool,
+            delay=settings.group_commit_ms / 1000,
+            timeout=settings.query_timeout,
+            max_steps=settings.max_steps,
+        )
+        if settings.group_commit_ms
+        else None
+    )
+    if settings.metrics_file and task_group is not None:
+        task_group.start_soon(
+            dump_metrics, metrics, pool, result_cache, settings.metrics_file, settings.metrics_interval
+        )
+    # Canned queries come straight from the metadata of the files being served, so that the catalog can be built later
+    served_stems = {PurePath(pool.sqlite_file).stem, *pool.attached_files}
     canned_queries = {}
-    for database in initial_catalog.databases:
-        for query_slug, query in initial_catalog.databases[database].queries.items():
+    for database_stem, database in metadata.databases.items():
+        if database_stem not in served_stems:
+            continue
+        for query_slug, query in database.queries.items():
             if query_slug.startswith("sqlite_"):
                 raise ValueError(f"Cannot start query slug with 'sqlite_', as that's a reserved prefix for mcp-sqlite.")
             # Extract named parameters from the query SQL
             query_params = sorted(set(re.findall(r":(\w+)", query.sql)))
+            if query.write and settings.immutable:
+                raise ValueError(f"Canned query '{query_slug}' writes to the databases, which are opened as immutable.")
+            if query.write and query.materialized:
+                raise ValueError(f"Canned query '{query_slug}' writes to the databases, so it can't be materialized.")
             canned_queries[query_slug] = (query_params, query)
+    # Compile every canned query once so that mistakes in the metadata fail at startup rather than on first call
+    async with pool.reader() as sqlite_connection:
+        for query_slug, (query_params, query) in canned_queries.items():
+            try:
+                await sqlite_connection.execute(f"explain {query.sql}", {param: None for param in query_params})
+            except sqlite3.Error as error:
+                raise ValueError(f"Canned query '{query_slug}' is invalid: {error}") from error
+    if settings.analyze and settings.immutable:
+        raise ValueError("Cannot analyze databases that are opened as immutable, as ANALYZE writes to them.")
+    if snapshot is not None and tuple(snapshot.schema_version) == await get_schema_version(pool):
+        catalog_cache.seed(
+            RootMetadata.model_validate_json(snapshot.catalog_json),
+            snapshot.catalog_json,
+            tuple(snapshot.schema_version),
+        )
+        logging.info("Loaded the catalog from the snapshot")
+    elif task_group is not None:
+        if snapshot is not None:
+            logging.info("Not using the catalog of the snapshot, as the schema changed since it was compiled")
+        task_group.start_soon(_warm_catalog, catalog_cache)
+    if settings.warm_up and task_group is not None:
+        task_group.start_soon(pool.warm_up)
+    if settings.enriched_catalog and task_group is not None:
+        task_group.start_soon(_warm_enriched_catalog, pool, catalog_cache, settings.analyze)
+    if materialized is not None and task_group is not None:
+        for query_slug, (query_params, query) in canned_queries.items():
+            if not query.materialized:
+                continue
+            # Queries without parameters are materialized right away, and others on their first call
+            if not query_params:
+                task_group.start_soon(_warm_materialized, materialized, query_slug, query)
+            if query.refresh_seconds:
+                task_group.start_soon(materialized.refresh_periodically, query_slug, query)
 
     get_catalog_description = (
         "Call this tool first! Returns the complete catalog of available databases, tables, and columns."
     )
     if len(metadata.databases) > 0:
         get_catalog_description += " The catalog contains important metadata!"
+    get_catalog_properties = {}
+    if settings.enriched_catalog:
+        get_catalog_description += (
+            " Pass enriched: true to also get column types, primary and foreign keys, indexes, estimated row counts,"
+            " and column statistics (distinct values, fraction of nulls, minimum and maximum) over a sample of rows"
+            " spread over each table."
+        )
+        get_catalog_properties["enriched"] = {"type": "boolean"}
+    list_tables_description = (
+        "Returns only the names of the tables in each database. "
+        "On large schemas, call this tool or sqlite_search_catalog() instead of sqlite_get_catalog(), "
+        "then sqlite_describe_tables() for the tables you need."
+    )
+    describe_tables_description = (
+        "Returns the catalog entries, with columns and metadata, of the given tables only. "
+        'Name each table either on its own or as "database.table".'
+    )
+    search_catalog_description = (
+        "Searches the names and metadata descriptions of tables and columns for keywords, tolerating partial words "
+        "and typos, and returns the best matching tables with the columns that matched."
+    )
+    explain_query_description = (
+        "Returns the query plan of SQL without running it, flags full scans of large tables, and suggests indexes "
+        "that would avoid them, each tried out on a copy of the schema. Call this before running a query that might "
+        "be slow on large tables."
+    )
+    stats_description = (
+        "Returns the server's performance statistics as JSON: latency histograms, rows, bytes, and cache hits of each "
+        "tool, result cache and connection queue counters, and the slowest recent queries with their query plans."
+    )
+
+    batch_description = (
+        "Runs several read-only queries, each either SQL or a canned query with its parameters, and returns all of "
+        "their results at once, one part per query in order. By default the queries run one after the other in a "
+        "single read transaction, so that they all see the same snapshot of the data. Pass parallel: true to run "
+        "them concurrently on separate connections instead. Prefer this tool over several calls in a row."
+    )
 
     execute_description = (
         "Call this tool to execute an arbitrary SQLite query. "
@@ -154,6 +2574,19 @@ async def mcp_sqlite_server(sqlite_file: str, metadata: RootMetadata = RootMetad
         execute_description += (
             " You should always execute a canned query tool instead of this tool where it makes sense!"
         )
+    export_description = (
+        "Runs a read-only query and streams all of its rows to a file on the server instead of returning them, "
+        "without any limit on rows or bytes. Returns the file's URI, its row count and size, the columns, and the "
+        "first rows. Use this for exports and reports too large to read through sqlite_execute."
+    )
+
+    execute_properties: dict[str, Any] = {"sql": {"type": "string"}}
+    if sampler.sampled_tables:
+        execute_description += (
+            " Pass sample: true to explore large tables that have a sample_fraction in the catalog quickly, reading "
+            "only a sample of their rows, with a note on how to scale counts and sums to the full tables."
+        )
+        execute_properties["sample"] = {"type": "boolean"}
 
     @server.list_tools()
     async def list_tools() -> list[Tool]:
@@ -161,25 +2594,125 @@ async def mcp_sqlite_server(sqlite_file: str, metadata: RootMetadata = RootMetad
             Tool(
                 name=f"{prefix}sqlite_get_catalog",
                 description=get_catalog_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": get_catalog_properties,
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_list_tables",
+                description=list_tables_description,
                 inputSchema={
                     "type": "object",
                     "properties": {},
                 },
             ),
             Tool(
-                name=f"{prefix}sqlite_execute",
-                description=execute_description,
+                name=f"{prefix}sqlite_describe_tables",
+                description=describe_tables_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "tables": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                        },
+                    }
+                    | get_catalog_properties,
+                    "required": ["tables"],
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_search_catalog",
+                description=search_catalog_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of tables to return. Defaults to 20.",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_explain_query",
+                description=explain_query_description,
                 inputSchema={
                     "type": "object",
                     "properties": {
                         "sql": {
                             "type": "string",
-                        }
+                        },
+                    },
+                    "required": ["sql"],
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_stats",
+                description=stats_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": {},
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_batch",
+                description=batch_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "queries": {
+                            "type": "array",
+                            "items": BATCH_QUERY_SCHEMA,
+                        },
+                        "parallel": {
+                            "type": "boolean",
+                        },
+                        **FORMAT_PROPERTIES,
+                    },
+                    "required": ["queries"],
+                },
+            ),
+            Tool(
+                name=f"{prefix}sqlite_execute",
+                description=execute_description,
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        **execute_properties,
+                        **FORMAT_PROPERTIES,
+                        **PAGINATION_PROPERTIES,
                     },
                     "required": ["sql"],
                 },
             ),
         ]
+        if settings.export_dir:
+            tools.append(
+                Tool(
+                    name=f"{prefix}sqlite_export",
+                    description=export_description,
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "sql": {
+                                "type": "string",
+                            },
+                            "format": {
+                                "type": "string",
+                                "enum": list(RESULT_FORMATS),
+                                "description": "Format of the file, csv by default.",
+                            },
+                        },
+                        "required": ["sql"],
+                    },
+                )
+            )
         for query_slug, (query_params, query) in canned_queries.items():
             if query.title:
                 query_description = f"{query.title.removesuffix('.')}."
@@ -200,44 +2733,447 @@ async def mcp_sqlite_server(sqlite_file: str, metadata: RootMetadata = RootMetad
                                 "type": "string",
                             }
                             for param in query_params
-                        },
-                        "required": query_params,
+                        }
+                        | canned_query_options(query_params, bool(query.write)),
+                        # Write queries take their parameters either one set at a time or in bulk through rows
+                        "required": [] if query.write and "rows" not in query_params else query_params,
                     },
                 )
             )
         return tools
 
-    @server.call_tool()
-    async def call_tool(name: str, arguments: dict[str, str]) -> list[TextContent]:
+    async def run_query(
+        sql: str, parameters: dict, options: dict, call_stats: CallStats, write: bool = False
+    ) -> list[TextContent]:
+        call_stats.sql, call_stats.parameters = sql, parameters
+        result_format = options.get("format") or settings.result_format
+        if not write and ("page_size" in options or "next_token" in options):
+            if options.get("page_size") is None:
+                page_size = settings.max_rows or FETCH_SIZE
+            elif (page_size := int(options["page_size"])) < 1:
+                raise ValueError(f"page_size must be at least 1, got {page_size}.")
+            if settings.max_rows:
+                page_size = min(page_size, settings.max_rows)
+            result = await paginator.page(
+                sql,
+                parameters,
+                page_size,
+                next_token=options.get("next_token"),
+                max_bytes=settings.max_bytes,
+                result_format=result_format,
+                timeout=settings.query_timeout,
+                max_steps=settings.max_steps,
+                call_stats=call_stats,
+            )
+            result += await check_scans(sql, parameters)
+        elif write and group_committer is not None and not RETURNING_PATTERN.search(sql):
+            result = await group_committer.write(sql, parameters)
+            result_cache.clear()
+        elif write or not result_cache.cacheable(sql):
+            result = await execute(
+                pool,
+                sql,
+                parameters,
+                write=write,
+                max_rows=settings.max_rows,
+                max_bytes=settings.max_bytes,
+                result_format=result_format,
+                timeout=settings.query_timeout,
+                max_steps=settings.max_steps,
+                call_stats=call_stats,
+            )
+            if write:
+                result_cache.clear()
+            else:
+                result += await check_scans(sql, parameters)
+        else:
+            cache_key = result_cache.key(sql, parameters, result_format)
+            data_version = await pool.data_version()
+            cached_result = result_cache.get(cache_key, data_version)
+            logging.debug(f"Result cache {'miss' if cached_result is None else 'hit'}: {result_cache.stats()}")
+            if cached_result is None:
+                result = await execute(
+                    pool,
+                    sql,
+                    parameters,
+                    max_rows=settings.max_rows,
+                    max_bytes=settings.max_bytes,
+                    result_format=result_format,
+                    timeout=settings.query_timeout,
+                    max_steps=settings.max_steps,
+                    call_stats=call_stats,
+                )
+                # Cached along with the note on its scans, so that repeating the query repeats the note too
+                result += await check_scans(sql, parameters)
+                result_cache.put(cache_key, data_version, result)
+            else:
+                result = cached_result
+                call_stats.cache_hit = True
+        return [TextContent(type="text", text=result)]
+
+    async def check_scans(sql: str, parameters: dict) -> str:
+        """Inspect the plan of a read that just ran if enabled, in the background unless its note is needed right away.
+        Returns the note about its scans to append to the results, or else an empty string.
+        """
+        if settings.scan_warnings or (settings.record_scans and task_group is None):
+            return await inspect_plan(sql, parameters)
+        if settings.record_scans and task_group is not None:
+            task_group.start_soon(inspect_plan, sql, parameters)
+        return ""
+
+    async def inspect_plan(sql: str, parameters: dict) -> str:
+        """Analyze the plan of a query that just ran, recording its scans of large tables if enabled.
+        Returns a note about those scans to append to the results if enabled, or else an empty string.
+        """
+        try:
+            analysis = await plan_analyzer.analyze(sql, parameters)
+        except sqlite3.Error as error:
+            logging.debug(f"Could not analyze the query plan of {sql}: {error}")
+            return ""
+        if settings.record_scans:
+            metrics.record_scans(sql, analysis)
+        if not settings.scan_warnings or not analysis["large_table_scans"]:
+            return ""
+        scanned_tables = ", ".join(
+            f"{scan['table']} (about {scan['estimated_rows']} rows)"
+            if scan["estimated_rows"] is not None
+            else scan["table"]
+            for scan in analysis["large_table_scans"]
+        )
+        return (
+            f"\nNote: this query reads every row of {scanned_tables}. Filter on indexed columns where possible, "
+            "and call sqlite_explain_query to see the query plan and suggested indexes."
+        )
+
+    async def run_bulk_write(sql: str, parameter_sets: Any, call_stats: CallStats) -> list[TextContent]:
+        if not isinstance(parameter_sets, list) or not all(isinstance(item, dict) for item in parameter_sets):
+            raise ValueError("Pass rows as an array of objects, each with every parameter of the query.")
+        call_stats.sql = sql
+        try:
+            result = await execute_many(
+                pool,
+                sql,
+                parameter_sets,
+                chunk_size=settings.write_chunk_size,
+                timeout=settings.query_timeout,
+                max_steps=settings.max_steps,
+            )
+        finally:
+            # Chunks committed before a failure still changed the data
+            result_cache.clear()
+        return [TextContent(type="text", text=result)]
+
+    async def run_batch(arguments: dict[str, Any], call_stats: CallStats) -> list[TextContent]:
+        batch_queries = arguments.get("queries") or []
+        if not batch_queries or not isinstance(batch_queries, list):
+            raise ValueError("Pass at least one query in queries.")
+        if len(batch_queries) > MAX_BATCH_QUERIES:
+            raise ValueError(f"A batch can have at most {MAX_BATCH_QUERIES} queries, got {len(batch_queries)}.")
+        result_format = arguments.get("format") or settings.result_format
+        # Check everything up front, so that no query runs unless the whole batch can
+        get_result_format(result_format)
+        statements = []
+        for query_number, batch_query in enumerate(batch_queries, start=1):
+            if not isinstance(batch_query, dict) or not isinstance(batch_query.get("parameters") or {}, dict):
+                raise ValueError(
+                    f"Query {query_number} must be an object with either sql or query, and parameters as an object."
+                )
+            query_slug = str(batch_query.get("query") or "").removeprefix(prefix)
+            if batch_query.get("sql"):
+                statements.append((str(batch_query["sql"]), {}))
+            elif query_slug in canned_queries:
+                _, query = canned_queries[query_slug]
+                if query.write:
+                    raise ValueError(
+                        f"Query {query_number} is canned query '{query_slug}', which writes and can't be batched."
+                    )
+                statements.append((query.sql, dict(batch_query.get("parameters") or {})))
+            else:
+                raise ValueError(f"Query {query_number} needs either sql or the name of a canned query in query.")
+            if TRANSACTION_CONTROL.match(mask_literals_and_comments(statements[-1][0])):
+                raise ValueError(
+                    f"Query {query_number} starts or ends a transaction, which a batch can't do, as its queries read "
+                    "the data in one transaction of their own."
+                )
+        results = [""] * len(statements)
+
+        async def run_statement(index: int, sqlite_connection: aiosqlite.Connection | None = None) -> None:
+            sql, parameters = statements[index]
+            try:
+                if sqlite_connection is None:
+                    results[index] = await execute(
+                        pool,
+                        sql,
+                        parameters,
+                        max_rows=settings.max_rows,
+                        max_bytes=settings.max_bytes,
+                        result_format=result_format,
+                        timeout=settings.query_timeout,
+                        max_steps=settings.max_steps,
+                        call_stats=call_stats,
+                    )
+                else:
+                    results[index] = await execute_on(
+                        sqlite_connection,
+                        sql,
+                        parameters,
+                        max_rows=settings.max_rows,
+                        max_bytes=settings.max_bytes,
+                        result_format=result_format,
+                        timeout=settings.query_timeout,
+                        max_steps=settings.max_steps,
+                        call_stats=call_stats,
+                    )
+            except (sqlite3.Error, QueryInterruptedError, PoolBusyError, ValueError) as error:
+                # One failing query doesn't keep the others from returning their results
+                results[index] = f"Query {index + 1} failed: {error}"
+
+        if arguments.get("parallel") in (True, "true"):
+            try:
+                async with anyio.create_task_group() as batch_task_group:
+                    for index in range(len(statements)):
+                        batch_task_group.start_soon(run_statement, index)
+            except ExceptionGroup as error_group:
+                # Report what went wrong rather than the task group it went wrong in
+                raise error_group.exceptions[0] from None
+        else:
+            async with pool.reader() as sqlite_connection:
+                # The snapshot of the data taken by the first query holds until the reader rolls back on release
+                await sqlite_connection.execute("begin")
+                for index in range(len(statements)):
+                    await run_statement(index, sqlite_connection)
+        return [TextContent(type="text", text=result) for result in results]
+
+    async def dispatch_tool(name: str, arguments: dict[str, Any], call_stats: CallStats) -> list[TextContent]:
+        enriched = settings.enriched_catalog and arguments.get("enriched") in (True, "true")
         if name == f"{prefix}sqlite_get_catalog":
-            catalog = await get_catalog(sqlite_file=sqlite_file, metadata=metadata)
-            return [TextContent(type="text", text=catalog.model_dump_json(exclude_none=True))]
+            if enriched:
+                _, enriched_json = await catalog_cache.get_enriched()
+                return [TextContent(type="text", text=enriched_json)]
+            _, catalog_json = await catalog_cache.get()
+            return [TextContent(type="text", text=catalog_json)]
+        elif name == f"{prefix}sqlite_list_tables":
+            catalog, _ = await catalog_cache.get()
+            table_names = {
+                database_name: list(database.tables) for database_name, database in catalog.databases.items()
+            }
+            return [TextContent(type="text", text=json.dumps(table_names, ensure_ascii=False, separators=(",", ":")))]
+        elif name == f"{prefix}sqlite_describe_tables":
+            table_names = arguments["tables"]
+            if isinstance(table_names, str):
+                table_names = [table_name.strip() for table_name in table_names.split(",")]
+            if enriched:
+                catalog_dict, _ = await catalog_cache.get_enriched()
+            else:
+                catalog, _ = await catalog_cache.get()
+                catalog_dict = catalog.model_dump(exclude_none=True)
+            described = filter_catalog(catalog_dict, table_names)
+            return [
+                TextContent(
+                    type="text",
+                    text=json.dumps(described, ensure_ascii=False, separators=(",", ":"), default=_json_default),
+                )
+            ]
+        elif name == f"{prefix}sqlite_search_catalog":
+            catalog_index = await catalog_cache.get_index()
+            results = catalog_index.search(arguments["query"], limit=int(arguments.get("limit") or 20))
+            return [TextContent(type="text", text=json.dumps(results, ensure_ascii=False, separators=(",", ":")))]
+        elif name == f"{prefix}sqlite_explain_query":
+            analysis = await plan_analyzer.analyze(arguments["sql"])
+            call_stats.sql = arguments["sql"]
+            return [TextContent(type="text", text=json.dumps(analysis, ensure_ascii=False, separators=(",", ":")))]
+        elif name == f"{prefix}sqlite_stats":
+            snapshot = metrics.snapshot(pool, result_cache)
+            return [TextContent(type="text", text=json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")))]
+        elif name == f"{prefix}sqlite_batch":
+            return await run_batch(arguments, call_stats)
+        elif name == f"{prefix}sqlite_export" and settings.export_dir:
+            result_format = arguments.get("format") or "csv"
+            if result_format not in RESULT_FORMATS:
+                raise ValueError(
+                    f"Unknown result format '{result_format}'. Supported formats: {', '.join(RESULT_FORMATS)}."
+                )
+            file_name = (
+                f"export-{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}.{EXPORT_EXTENSIONS[result_format]}"
+            )
+            call_stats.sql = arguments["sql"]
+            summary = await export_results(
+                pool,
+                arguments["sql"],
+                os.path.join(settings.export_dir, file_name),
+                result_format=result_format,
+                timeout=settings.query_timeout,
+                max_steps=settings.max_steps,
+                call_stats=call_stats,
+            )
+            return [
+                TextContent(
+                    type="text",
+                    text=json.dumps(summary, ensure_ascii=False, separators=(",", ":"), default=_json_default),
+                )
+            ]
         elif name == f"{prefix}sqlite_execute":
-            return [TextContent(type="text", text=await execute(sqlite_file, arguments["sql"]))]
+            if sampler.sampled_tables and arguments.get("sample") in (True, "true"):
+                sampled_sql, note = await sampler.rewrite(arguments["sql"])
+                contents = await run_query(sampled_sql, {}, arguments, call_stats)
+                return [TextContent(type="text", text=content.text + note) for content in contents]
+            return await run_query(arguments["sql"], {}, arguments, call_stats)
         else:
             query_slug = name.removeprefix(prefix)
             if query_slug in canned_queries:
-                _, query = canned_queries[query_slug]
-                return [
-                    TextContent(
-                        type="text", text=await execute(sqlite_file, query.sql, arguments, write=bool(query.write))
+                query_params, query = canned_queries[query_slug]
+                query_options = canned_query_options(query_params, bool(query.write))
+                if "rows" in query_options and "rows" in arguments:
+                    return await run_bulk_write(query.sql, arguments["rows"], call_stats)
+                options = {key: value for key, value in arguments.items() if key in query_options}
+                parameters = {key: value for key, value in arguments.items() if key not in query_options}
+                # Pages are read from the query itself, as they need a cursor kept open on its results
+                paginated = "page_size" in options or "next_token" in options
+                if query.materialized and materialized is not None and not paginated:
+                    call_stats.sql, call_stats.parameters = query.sql, parameters
+                    result = await materialized.serve(
+                        query_slug,
+                        query,
+                        parameters,
+                        max_rows=settings.max_rows,
+                        max_bytes=settings.max_bytes,
+                        result_format=options.get("format") or settings.result_format,
+                        call_stats=call_stats,
                     )
-                ]
+                    if result is not None:
+                        return [TextContent(type="text", text=result)]
+                return await run_query(query.sql, parameters, options, call_stats, write=bool(query.write))
         raise ValueError(f"Unknown tool: {name}")
 
+    @server.call_tool()
+    async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
+        call_stats = CallStats(name.removeprefix(prefix))
+        started_at = time.perf_counter()
+        contents: list[TextContent] = []
+        try:
+            contents = await dispatch_tool(name, arguments, call_stats)
+            return contents
+        finally:
+            seconds = time.perf_counter() - started_at
+            output_bytes = sum(len(content.text.encode()) for content in contents)
+            if metrics.observe(seconds, call_stats, output_bytes, error=not contents):
+                if task_group is not None:
+                    task_group.start_soon(metrics.log_slow_query, pool, call_stats, seconds)
+                else:
+                    await metrics.log_slow_query(pool, call_stats, seconds)
+
     return server
 
 
-async def run_server(sqlite_file: str, metadata_yaml_file: str | None = None, prefix: str = ""):
-    if metadata_yaml_file:
-        with open(metadata_yaml_file, "r") as metadata_file_descriptor:
-            metadata_dict = yaml.safe_load(metadata_file_descriptor.read())
+async def serve_http(server: Server, transport: str = "http", host: str = "127.0.0.1", port: int = 8000):
+    """Serve any number of concurrent MCP sessions over streamable HTTP (at /mcp) or SSE (at /sse), all sharing the
+    same server along with its connection pool and caches.
+    """
+    from mcp.server.sse import SseServerTransport
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from starlette.routing import Mount, Route
+    from starlette.types import Receive, Scope, Send
+    import uvicorn
+
+    if transport == "http":
+        session_manager = StreamableHTTPSessionManager(app=server)
+
+        async def handle_streamable_http(scope: Scope, receive: Receive, send: Send) -> None:
+            await session_manager.handle_request(scope, receive, send)
+
+        app = Starlette(
+            routes=[Mount("/mcp", app=handle_streamable_http)],
+            lifespan=lambda _: session_manager.run(),
+        )
+    elif transport == "sse":
+        sse = SseServerTransport("/messages/")
+
+        async def handle_sse(request: Request) -> Response:
+            async with sse.connect_sse(request.scope, request.receive, request._send) as (read_stream, write_stream):
+                await server.run(read_stream, write_stream, server.create_initialization_options())
+            return Response()
+
+        app = Starlette(
+            routes=[
+                Route("/sse", endpoint=handle_sse, methods=["GET"]),
+                Mount("/messages/", app=sse.handle_post_message),
+            ]
+        )
+    else:
+        raise ValueError(f"Unknown HTTP transport '{transport}'.")
+    # Without a log config of its own, uvicorn logs through the root logger set up by main_cli()
+    await uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_config=None)).serve()
+
+
+async def run_server(
+    sqlite_file: str | Sequence[str],
+    metadata_yaml_file: str | None = None,
+    prefix: str = "",
+    settings: ServerSettings = ServerSettings(),
+    transport: str = "stdio",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    snapshot_file: str | None = None,
+):
+    # The first file is the main database, and any others are attached to it
+    sqlite_files = [sqlite_file] if isinstance(sqlite_file, str) else list(sqlite_file)
+    snapshot = read_snapshot(snapshot_file, sqlite_files, metadata_yaml_file) if snapshot_file else None
+    if snapshot is not None:
+        metadata_dict = snapshot.metadata
     else:
-        metadata_dict = {}
-    server = await mcp_sqlite_server(sqlite_file=sqlite_file, metadata=RootMetadata(**metadata_dict), prefix=prefix)
-    options = server.create_initialization_options()
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(read_stream, write_stream, options)
+        metadata_dict, _ = read_metadata_file(metadata_yaml_file)
+    serving_scope = anyio.CancelScope()
+    async with anyio.create_task_group() as task_group:
+        # Handled until the server is closed, as clients may send SIGTERM right after closing stdin
+        if sys.platform != "win32":
+            task_group.start_soon(_stop_on_sigterm, serving_scope)
+        async with mcp_sqlite_server(
+            sqlite_file=sqlite_files[0],
+            metadata=RootMetadata(**metadata_dict),
+            prefix=prefix,
+            settings=settings,
+            attach_files=sqlite_files[1:],
+            snapshot=snapshot,
+        ) as server:
+            logging.info(
+                f"Ready to serve over {transport} {(time.perf_counter() - STARTED_AT) * 1000:.0f}ms after startup"
+            )
+            with serving_scope:
+                if transport == "stdio":
+                    options = server.create_initialization_options()
+                    async with stdio_server() as (read_stream, write_stream):
+                        await server.run(read_stream, write_stream, options)
+                else:
+                    await serve_http(server, transport=transport, host=host, port=port)
+        task_group.cancel_scope.cancel()
+
+
+async def _stop_on_sigterm(serving_scope: anyio.CancelScope):
+    """Stop serving on SIGTERM, which MCP clients send to stdio servers once they're done, so that connections are
+    closed and temporary files are removed on the way out rather than left behind.
+    """
+    with anyio.open_signal_receiver(signal.SIGTERM) as signals:
+        async for _ in signals:
+            logging.info("Stopping on SIGTERM")
+            serving_scope.cancel()
+
+
+# File name patterns of the SQLite files served from a directory given on the command line
+SQLITE_FILE_PATTERNS = ["*.db", "*.sqlite", "*.sqlite3"]
+
+
+def expand_sqlite_files(pattern: str) -> list[str]:
+    """Expand a command-line argument naming a SQLite file, a directory of them, or a glob pattern."""
+    if os.path.isdir(pattern):
+        return sorted(
+            path for file_pattern in SQLITE_FILE_PATTERNS for path in glob.glob(os.path.join(pattern, file_pattern))
+        )
+    if any(character in pattern for character in "*?["):
+        return sorted(glob.glob(pattern))
+    return [pattern]
 
 
 def main_cli():
@@ -247,7 +3183,10 @@ def main_cli():
     )
     parser.add_argument(
         "sqlite_file",
-        help="Path to SQLite file to serve the MCP server for.",
+        help="Path to SQLite file to serve the MCP server for. "
+        "Additional files, directories, or glob patterns are attached to the first file under their stem for "
+        "cross-database queries.",
+        nargs="+",
     )
     parser.add_argument(
         "-m",
@@ -260,6 +3199,203 @@ def main_cli():
         help="Prefix for MCP tools. Defaults to no prefix.",
         default="",
     )
+    parser.add_argument(
+        "--snapshot",
+        help="Path to a snapshot of the metadata and catalog compiled with --compile-snapshot, used at startup instead "
+        "of parsing the metadata file and introspecting the files as long as neither changed since.",
+    )
+    parser.add_argument(
+        "--compile-snapshot",
+        help="Compile the snapshot given with --snapshot and exit instead of starting the server.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pool-size",
+        help="Number of read-only SQLite connections kept open for concurrent tool calls. Defaults to 4.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--max-queued",
+        help="Maximum number of queries waiting for a free connection before new ones are rejected, 0 for unlimited. "
+        "Defaults to 64.",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--max-rows",
+        help="Maximum number of rows returned by a single query, 0 for unlimited. Defaults to 1000.",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--max-bytes",
+        help="Maximum size in bytes of the results returned by a single query, 0 for unlimited. Defaults to 1000000.",
+        type=int,
+        default=1_000_000,
+    )
+    parser.add_argument(
+        "--query-timeout",
+        help="Seconds after which a running query is interrupted, 0 for unlimited. Defaults to 30.",
+        type=float,
+        default=30,
+    )
+    parser.add_argument(
+        "--max-steps",
+        help="SQLite virtual machine steps after which a running query is interrupted, 0 for unlimited. Defaults to 0.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        help="Maximum number of query results kept in the result cache, 0 to disable it. Defaults to 128.",
+        type=int,
+        default=128,
+    )
+    parser.add_argument(
+        "--result-cache-ttl",
+        help="Seconds a cached query result stays valid if the data doesn't change. Defaults to 60.",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--enriched-catalog",
+        help="Let the agent ask for a catalog enriched with column types, keys, indexes, estimated row counts, and "
+        "column statistics, built in the background at startup and rebuilt when the data changes.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--analyze",
+        help="Run ANALYZE at startup so that the enriched catalog can estimate row counts. Needs write access.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stats-sample-rows",
+        help="Number of rows spread over each table that the enriched catalog's column statistics are computed "
+        "over, 0 to skip them. Defaults to 10000.",
+        type=int,
+        default=10_000,
+    )
+    parser.add_argument(
+        "--slow-query-seconds",
+        help="Seconds after which a query is logged as slow along with its query plan, 0 to disable. Defaults to 1.",
+        type=float,
+        default=1,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="File to write per-tool latency histograms and other metrics to periodically, in the Prometheus text "
+        "format if the name ends in .prom or .txt and as JSON otherwise.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        help="Seconds between writes of the metrics file. Defaults to 60.",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--large-table-rows",
+        help="Number of rows from which a table counts as large when a query plan scans all of it. Defaults to 10000.",
+        type=int,
+        default=10_000,
+    )
+    parser.add_argument(
+        "--scan-warnings",
+        help="Check the query plan of each query and warn the agent in the results when it reads every row of a large "
+        "table.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--record-scans",
+        help="Check the query plan of each query in the background and count scans of large tables along with the "
+        "index that would avoid them, reported by sqlite_stats and in the metrics file.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--mmap-size",
+        help="Bytes of each file that read-only connections access through memory-mapped I/O instead of read calls, "
+        "e.g. 1073741824 for the first GiB. Defaults to 0, leaving SQLite's default.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="KiB of page cache of each read-only connection. Defaults to 0, leaving SQLite's default of 2000 KiB.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--temp-store-memory",
+        help="Keep temporary tables and indices (e.g. for sorting) of read-only connections in memory.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--query-only",
+        help="Reject any writes through read-only connections, including to temporary tables.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--immutable",
+        help="Open the files as immutable, skipping all locking and change detection. Only use with files that never "
+        "change while the server runs. Incompatible with canned write queries and --analyze.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--warm-up",
+        help="Read the files once in the background at startup so that the operating system caches their pages.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--export-dir",
+        help="Directory to offer the sqlite_export tool streaming full query results to files in. The tool is left "
+        "out if not given.",
+    )
+    parser.add_argument(
+        "--write-chunk-size",
+        help="Parameter sets written by one bulk write of a canned query before committing. Defaults to 0, writing "
+        "them all in one transaction.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--wal",
+        help="Switch the files that canned queries write to to write-ahead logging, so that writes don't block reads "
+        "and commit faster. The files stay in WAL mode afterwards.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--group-commit-ms",
+        help="Milliseconds single-row writes of canned queries wait to be committed in one transaction together with "
+        "concurrent ones. Defaults to 0, committing each write on its own.",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Default format of query results returned to the agent. Defaults to html.",
+        choices=list(RESULT_FORMATS),
+        default="html",
+    )
+    parser.add_argument(
+        "-t",
+        "--transport",
+        help="Serve a single client over stdio, or any number of clients over streamable HTTP at /mcp or SSE at /sse. "
+        "Defaults to stdio.",
+        choices=["stdio", "http", "sse"],
+        default="stdio",
+    )
+    parser.add_argument(
+        "--host",
+        help="Host to listen on with the http and sse transports. Defaults to 127.0.0.1.",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        help="Port to listen on with the http and sse transports. Defaults to 8000.",
+        type=int,
+        default=8000,
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -267,10 +3403,61 @@ def main_cli():
         action="count",
         default=0,
     )
-    args = parser.parse_args()
+    args = parser.parse_intermixed_args()
     LOGGING_LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
     logging.basicConfig(level=LOGGING_LEVELS[min(args.verbose, len(LOGGING_LEVELS) - 1)])  # cap to last level index
-    anyio.run(run_server, args.sqlite_file, args.metadata, args.prefix)
+    settings = ServerSettings(
+        pool_size=args.pool_size,
+        max_queued=args.max_queued,
+        max_rows=args.max_rows,
+        max_bytes=args.max_bytes,
+        result_format=args.format,
+        query_timeout=args.query_timeout,
+        max_steps=args.max_steps,
+        result_cache_size=args.result_cache_size,
+        result_cache_ttl=args.result_cache_ttl,
+        enriched_catalog=args.enriched_catalog,
+        analyze=args.analyze,
+        stats_sample_rows=args.stats_sample_rows,
+        slow_query_seconds=args.slow_query_seconds,
+        metrics_file=args.metrics_file,
+        metrics_interval=args.metrics_interval,
+        large_table_rows=args.large_table_rows,
+        scan_warnings=args.scan_warnings,
+        record_scans=args.record_scans,
+        mmap_size=args.mmap_size,
+        cache_size=args.cache_size,
+        temp_store_memory=args.temp_store_memory,
+        query_only=args.query_only,
+        immutable=args.immutable,
+        warm_up=args.warm_up,
+        write_chunk_size=args.write_chunk_size,
+        wal=args.wal,
+        group_commit_ms=args.group_commit_ms,
+        export_dir=args.export_dir,
+    )
+    sqlite_files = []
+    for pattern in args.sqlite_file:
+        matches = expand_sqlite_files(pattern)
+        if not matches:
+            parser.error(f"no SQLite files match {pattern}")
+        sqlite_files += matches
+    if args.compile_snapshot:
+        if not args.snapshot:
+            parser.error("--compile-snapshot requires --snapshot")
+        anyio.run(compile_snapshot, sqlite_files, args.metadata, args.snapshot)
+        return
+    anyio.run(
+        run_server,
+        sqlite_files,
+        args.metadata,
+        args.prefix,
+        settings,
+        args.transport,
+        args.host,
+        args.port,
+        args.snapshot,
+    )
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
+from contextlib import asynccontextmanager
 import json
 from pathlib import Path
+import socket
 import tempfile
 
 import aiofiles
 import aiosqlite
 import asyncio
 from mcp.client.session import ClientSession
+from mcp.client.sse import sse_client
 from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.client.streamable_http import streamablehttp_client
 import yaml
 import pytest
 
@@ -16,7 +20,7 @@ def anyio_backend():
     return "asyncio"
 
 
-async def session_generator(statements, metadata, metadata_yaml=True, prefix=None):
+async def session_generator(statements, metadata, metadata_yaml=True, prefix=None, extra_args=()):
     # Create the SQLite database file
     async with aiofiles.tempfile.NamedTemporaryFile(
         "w", prefix="mcp_sqlite_test_", suffix=".db", delete_on_close=False
@@ -53,6 +57,7 @@ async def session_generator(statements, metadata, metadata_yaml=True, prefix=Non
             ]
             if prefix:
                 args += ["--prefix", prefix]
+            args += list(extra_args)
             async with stdio_client(
                 StdioServerParameters(
                     command="uv",
@@ -66,11 +71,68 @@ async def session_generator(statements, metadata, metadata_yaml=True, prefix=Non
             await asyncio.sleep(1)
 
 
+async def http_server_generator(statements, transport):
+    """Start a server over HTTP on a free local port and yield a function opening new client sessions to it."""
+    async with aiofiles.tempfile.NamedTemporaryFile(
+        "w", prefix="mcp_sqlite_test_", suffix=".db", delete_on_close=False
+    ) as db_file:
+        await db_file.close()
+        async with aiosqlite.connect(f"file:{db_file.name}", uri=True) as sqlite_connection:
+            for statement in statements:
+                await sqlite_connection.execute(statement)
+            await sqlite_connection.commit()
+        with socket.socket() as free_socket:
+            free_socket.bind(("127.0.0.1", 0))
+            port = free_socket.getsockname()[1]
+        process = await asyncio.create_subprocess_exec(
+            "uv",
+            "--directory",
+            str(Path(__file__).parent.parent),
+            "run",
+            "mcp_sqlite/server.py",
+            str(db_file.name),
+            "--transport",
+            transport,
+            "--port",
+            str(port),
+        )
+        try:
+            # Wait for the server to accept connections
+            for _ in range(100):
+                try:
+                    _, writer = await asyncio.open_connection("127.0.0.1", port)
+                    writer.close()
+                    break
+                except OSError:
+                    await asyncio.sleep(0.1)
+
+            @asynccontextmanager
+            async def open_session():
+                if transport == "http":
+                    client = streamablehttp_client(f"http://127.0.0.1:{port}/mcp/")
+                else:
+                    client = sse_client(f"http://127.0.0.1:{port}/sse")
+                async with client as (read, write, *_):
+                    async with ClientSession(read, write) as session:
+                        await session.initialize()
+                        yield session
+
+            yield open_session
+        finally:
+            process.terminate()
+            await process.wait()
+
+
 @pytest.fixture(scope="session")
 async def get_session_generator():
     return session_generator
 
 
+@pytest.fixture(scope="session")
+async def get_http_server_generator():
+    return http_server_generator
+
+
 @pytest.fixture(scope="session")
 async def empty_tuple():
     async for session_tuple in session_generator([], {}):
@@ -191,6 +253,11 @@ async def canned_tuple():
                             "write": True,
                             "sql": "insert into table4 values(:value)",
                         },
+                        "create_table5": {
+                            "title": "This will change the schema of the database by creating a new table",
+                            "write": True,
+                            "sql": "create table if not exists table5 (col5)",
+                        },
                     },
                 }
             },
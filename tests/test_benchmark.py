@@ -0,0 +1,18 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_benchmark_smoke(tmp_path):
+    output_file = tmp_path / "results.json"
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.benchmark", "--tables", "2", "--rows", "50", "--query-rows", "10"]
+        + ["--repeat", "1", "--startup-repeat", "1", "--output", str(output_file)],
+        cwd=Path(__file__).parent.parent,
+        check=True,
+    )
+    results = json.loads(output_file.read_text())
+    assert results["parameters"]["tables"] == 2
+    assert set(results["results"]) == {"catalog", "queries", "serialization", "round_trip", "startup"}
+    assert results["results"]["round_trip"]["execute"]["runs"] == 1
@@ -1,3 +1,4 @@
+import anyio
 import pytest
 
 
@@ -43,3 +44,211 @@ async def test_canned_query_write_succeeds(canned_tuple):
     result = await canned_session.call_tool("custom_prefix_write_succeeds", {"value": 8})
     assert len(result.content) == 1
     assert result.content[0].text == "Statement executed successfully"
+
+
+@pytest.mark.anyio
+async def test_canned_query_write_is_committed(canned_tuple):
+    _, canned_session = canned_tuple
+    await canned_session.call_tool("custom_prefix_write_succeeds", {"value": 1234})
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_execute", {"sql": "select count(*) as c from table4 where col4 = 1234"}
+    )
+    assert len(result.content) == 1
+    assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>1</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_canned_query_invalid_sql_raises_error(get_session_generator):
+    with pytest.raises(ExceptionGroup):
+        async for _ in get_session_generator([], {"databases": {"_": {"queries": {"broken": {"sql": "selec 42"}}}}}):
+            pass
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("parallel", [False, True])
+async def test_batch(canned_tuple, parallel):
+    _, canned_session = canned_tuple
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_batch",
+        {
+            "queries": [
+                {"sql": "select col1 from table1 order by col1"},
+                {"query": "add_integers", "parameters": {"a": "2", "b": "3"}},
+                {"sql": "select nonexistent from table1"},
+                {"query": "custom_prefix_answer_to_life"},
+            ],
+            "parallel": parallel,
+            "format": "csv",
+        },
+    )
+    assert not result.isError
+    assert [content.text for content in result.content] == [
+        "col1\n3\n4\n",
+        "total\n5\n",
+        "Query 3 failed: no such column: nonexistent",
+        "42\n42\n",
+    ]
+
+
+@pytest.mark.anyio
+async def test_batch_rejects_writes(canned_tuple):
+    _, canned_session = canned_tuple
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_batch", {"queries": [{"query": "write_succeeds", "parameters": {"value": "1"}}]}
+    )
+    assert result.isError
+    assert "writes and can't be batched" in result.content[0].text
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "arguments, error",
+    [
+        ({"queries": [{"sql": "select 1"}], "format": "xml", "parallel": True}, "Unknown result format 'xml'"),
+        ({"queries": ["select 1"]}, "Query 1 must be an object with either sql or query"),
+        ({"queries": [{"query": "add_integers", "parameters": "a=1"}]}, "Query 1 must be an object"),
+        ({"queries": [{"sql": "select 1"}, {"sql": "commit"}]}, "Query 2 starts or ends a transaction"),
+        ({"queries": [{"sql": "/* done */ ROLLBACK"}]}, "Query 1 starts or ends a transaction"),
+        ({"queries": [{"sql": "savepoint s"}], "parallel": True}, "Query 1 starts or ends a transaction"),
+    ],
+)
+async def test_batch_rejects_invalid_queries(canned_tuple, arguments, error):
+    _, canned_session = canned_tuple
+    result = await canned_session.call_tool("custom_prefix_sqlite_batch", arguments)
+    assert result.isError
+    assert result.content[0].text.startswith(error)
+
+
+@pytest.mark.anyio
+async def test_canned_query_bulk_write(canned_tuple):
+    _, canned_session = canned_tuple
+    result = await canned_session.call_tool(
+        "custom_prefix_write_succeeds", {"rows": [{"value": 4321}, {"value": 4321}, {"value": 4321}]}
+    )
+    assert not result.isError
+    assert (
+        result.content[0].text
+        == "Statement executed successfully for 3 parameter sets, changing 3 rows in 1 transaction"
+    )
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_execute", {"sql": "select count(*) as c from table4 where col4 = 4321"}
+    )
+    assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>3</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_chunked_bulk_write_and_group_commit(get_session_generator):
+    async for _, session in get_session_generator(
+        ["create table items (id integer primary key)"],
+        {"databases": {"_": {"queries": {"add_item": {"sql": "insert into items values (:id)", "write": True}}}}},
+        extra_args=["--write-chunk-size", "2", "--wal", "--group-commit-ms", "50"],
+    ):
+        result = await session.call_tool("add_item", {"rows": [{"id": str(id)} for id in range(1, 6)]})
+        assert result.content[0].text == (
+            "Statement executed successfully for 5 parameter sets, changing 5 rows in 3 transactions"
+        )
+        # The chunk with the duplicate is rolled back, while the chunk before it stays committed
+        result = await session.call_tool("add_item", {"rows": [{"id": "6"}, {"id": "7"}, {"id": "8"}, {"id": "1"}]})
+        assert result.isError
+        assert "Committed the first 2 of 4 parameter sets" in result.content[0].text
+        # Concurrent single-row writes share a commit, and a failing one doesn't fail the others
+        results = {}
+
+        async def add_item(id: str):
+            results[id] = await session.call_tool("add_item", {"id": id})
+
+        async with anyio.create_task_group() as task_group:
+            for id in ["10", "11", "2", "12"]:
+                task_group.start_soon(add_item, id)
+        assert [results[id].isError for id in ["10", "11", "2", "12"]] == [False, False, True, False]
+        assert "UNIQUE constraint failed" in results["2"].content[0].text
+        result = await session.call_tool(
+            "sqlite_execute", {"sql": "select group_concat(id) as ids from items", "format": "csv"}
+        )
+        assert result.content[0].text == 'ids\n"1,2,3,4,5,6,7,10,11,12"\n'
+        result = await session.call_tool("sqlite_execute", {"sql": "pragma journal_mode", "format": "csv"})
+        assert result.content[0].text == "journal_mode\nwal\n"
+
+
+@pytest.mark.anyio
+async def test_materialized_canned_queries(get_session_generator):
+    queries = {
+        "total": {"sql": "select count(*) as c from items", "materialized": True},
+        "count_kind": {
+            "sql": "select count(*) as c from items where kind = :kind",
+            "materialized": True,
+            "refresh_seconds": 1,
+        },
+        "add_item": {"sql": "insert into items values (:kind)", "write": True},
+    }
+    async for _, session in get_session_generator(
+        ["create table items (kind)", "insert into items values ('a'), ('a'), ('b')"],
+        {"databases": {"_": {"queries": queries}}},
+    ):
+        result = await session.call_tool("total", {"format": "csv"})
+        assert result.content[0].text.startswith("c\n3\n\nMaterialized: precomputed")
+        assert "recomputed whenever the data changes" in result.content[0].text
+        result = await session.call_tool("count_kind", {"kind": "a", "format": "csv"})
+        assert result.content[0].text.startswith("c\n2\n\nMaterialized: precomputed")
+        assert "recomputed every 1 seconds." in result.content[0].text
+        await session.call_tool("add_item", {"kind": "a"})
+        # Results refreshed on data changes are recomputed on the next call, and scheduled ones on schedule
+        result = await session.call_tool("total", {"format": "csv"})
+        assert result.content[0].text.startswith("c\n4\n")
+        result = await session.call_tool("count_kind", {"kind": "a", "format": "csv"})
+        assert result.content[0].text.startswith("c\n2\n")
+        assert "The data changed since, so these results may be stale." in result.content[0].text
+        await anyio.sleep(1.5)
+        result = await session.call_tool("count_kind", {"kind": "a", "format": "csv"})
+        assert result.content[0].text.startswith("c\n3\n")
+        assert "stale" not in result.content[0].text
+        # Paginated calls read the query itself
+        result = await session.call_tool("total", {"format": "csv", "page_size": 10})
+        assert result.content[0].text == "c\n4\n"
+
+
+@pytest.mark.anyio
+async def test_write_between_pages(canned_tuple):
+    _, canned_session = canned_tuple
+    sql = "select col1 from table1 order by col1"
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_execute", {"sql": sql, "page_size": 1, "format": "csv"}
+    )
+    next_token = result.content[0].text.split('"')[1]
+    # The open page doesn't keep the write from committing
+    with anyio.fail_after(3):
+        result = await canned_session.call_tool("custom_prefix_write_succeeds", {"value": 99})
+    assert result.content[0].text == "Statement executed successfully"
+    result = await canned_session.call_tool(
+        "custom_prefix_sqlite_execute", {"sql": sql, "page_size": 1, "format": "csv", "next_token": next_token}
+    )
+    assert result.content[0].text.startswith("col1\n4\n\nThe data was written to since the previous page")
+
+
+@pytest.mark.anyio
+async def test_canned_query_parameters_named_like_options(get_session_generator):
+    queries = {"echo": {"sql": "select :format as f, :page_size as p"}}
+    async for _, session in get_session_generator([], {"databases": {"_": {"queries": queries}}}):
+        tools = await session.list_tools()
+        echo_tool = next(tool for tool in tools.tools if tool.name == "echo")
+        # The query's own parameters take the place of the options named like them
+        assert sorted(echo_tool.inputSchema["properties"]) == ["format", "page_size"]
+        assert echo_tool.inputSchema["properties"]["format"] == {"type": "string"}
+        result = await session.call_tool("echo", {"format": "fancy", "page_size": "3"})
+        assert result.content[0].text == "<table><tr><th>f</th><th>p</th></tr><tr><td>fancy</td><td>3</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_write_canned_query_parameter_named_rows(get_session_generator):
+    queries = {"add": {"sql": "insert into counts values (:rows)", "write": True}}
+    async for _, session in get_session_generator(
+        ["create table counts (n)"], {"databases": {"_": {"queries": queries}}}
+    ):
+        tools = await session.list_tools()
+        add_tool = next(tool for tool in tools.tools if tool.name == "add")
+        assert add_tool.inputSchema["properties"]["rows"] == {"type": "string"}
+        assert add_tool.inputSchema["required"] == ["rows"]
+        result = await session.call_tool("add", {"rows": 7})
+        assert result.content[0].text == "Statement executed successfully"
+        result = await session.call_tool("sqlite_execute", {"sql": "select n from counts", "format": "csv"})
+        assert result.content[0].text == "n\n7\n"
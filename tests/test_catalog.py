@@ -1,6 +1,12 @@
 import json
+from pathlib import Path
 
+import aiosqlite
+import anyio
+from mcp.client.session import ClientSession
+from mcp.client.stdio import StdioServerParameters, stdio_client
 import pytest
+import yaml
 
 
 @pytest.mark.anyio
@@ -89,3 +95,254 @@ async def test_small_metadata_catalog(small_tuple):
             },
         },
     }
+
+
+@pytest.mark.anyio
+async def test_catalog_reflects_schema_changes(canned_tuple):
+    _, canned_session = canned_tuple
+    result = await canned_session.call_tool("custom_prefix_sqlite_get_catalog", {})
+    assert "table5" not in json.loads(result.content[0].text)["databases"]["main"]["tables"]
+    # Repeated calls return the same cached catalog
+    assert (await canned_session.call_tool("custom_prefix_sqlite_get_catalog", {})).content[0].text == (
+        result.content[0].text
+    )
+    await canned_session.call_tool("custom_prefix_create_table5", {})
+    result = await canned_session.call_tool("custom_prefix_sqlite_get_catalog", {})
+    assert json.loads(result.content[0].text)["databases"]["main"]["tables"]["table5"] == {"columns": {"col5": ""}}
+
+
+@pytest.mark.anyio
+async def test_multiple_databases(get_session_generator, tmp_path):
+    other_db_file = tmp_path / "other-db.db"
+    async with aiosqlite.connect(other_db_file) as sqlite_connection:
+        await sqlite_connection.execute("create table other_table (id, label)")
+        await sqlite_connection.execute("insert into other_table values (1, 'one')")
+        await sqlite_connection.commit()
+    metadata = {
+        "databases": {
+            "other-db": {
+                "tables": {"other_table": {"columns": {"label": "Label of the row"}}},
+                "queries": {"other_labels": {"sql": 'select label from "other-db".other_table'}},
+            }
+        }
+    }
+    async for main_stem, session in get_session_generator(
+        ["create table main_table (id)", "insert into main_table values (1)"], metadata, extra_args=[str(other_db_file)]
+    ):
+        result = await session.call_tool("sqlite_get_catalog", {})
+        assert json.loads(result.content[0].text)["databases"] == {
+            "main": {"title": main_stem, "queries": {}, "tables": {"main_table": {"columns": {"id": ""}}}},
+            "other-db": {
+                "title": "other-db",
+                "queries": {"other_labels": {"sql": 'select label from "other-db".other_table'}},
+                "tables": {"other_table": {"columns": {"id": "", "label": "Label of the row"}}},
+            },
+        }
+        result = await session.call_tool(
+            "sqlite_execute",
+            {"sql": 'select label from main_table join "other-db".other_table using (id)', "format": "csv"},
+        )
+        assert result.content[0].text == "label\none\n"
+        result = await session.call_tool("other_labels", {"format": "csv"})
+        assert result.content[0].text == "label\none\n"
+
+
+@pytest.mark.anyio
+async def test_catalog_names_and_order(get_session_generator, tmp_path):
+    other_db_file = tmp_path / "other-db.db"
+    async with aiosqlite.connect(other_db_file) as sqlite_connection:
+        await sqlite_connection.execute("create table x2 (b, a)")
+        await sqlite_connection.execute("create table x1 (c)")
+        await sqlite_connection.commit()
+    statements = [
+        'create table "with space" (z, "odd ""column""")',
+        'create table "odd ""name""" (col1)',
+        "create table alpha (y, x)",
+        "create table Zebra (col1)",
+        'create table "b.c" (col1)',
+    ]
+    async for _, session in get_session_generator(statements, {}, extra_args=[str(other_db_file)]):
+        result = await session.call_tool("sqlite_get_catalog", {})
+        databases = json.loads(result.content[0].text)["databases"]
+        # Databases in the order they were attached, tables by name, and columns in the order of the table definition
+        assert list(databases) == ["main", "other-db"]
+        assert list(databases["main"]["tables"].items()) == [
+            ("Zebra", {"columns": {"col1": ""}}),
+            ("alpha", {"columns": {"y": "", "x": ""}}),
+            ("b.c", {"columns": {"col1": ""}}),
+            ('odd "name"', {"columns": {"col1": ""}}),
+            ("with space", {"columns": {"z": "", 'odd "column"': ""}}),
+        ]
+        assert list(databases["other-db"]["tables"].items()) == [
+            ("x1", {"columns": {"c": ""}}),
+            ("x2", {"columns": {"b": "", "a": ""}}),
+        ]
+        result = await session.call_tool("sqlite_execute", {"sql": 'select col1 from "odd ""name"""', "format": "csv"})
+        assert result.content[0].text == "col1\n"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("pattern", ["", "*.db", "missing-*.sqlite"])
+async def test_patterns_matching_no_files_rejected(tmp_path, pattern):
+    server_args = ["--directory", str(Path(__file__).parent.parent), "run", "mcp_sqlite/server.py"]
+    result = await anyio.run_process(["uv", *server_args, str(tmp_path / pattern)], check=False)
+    assert result.returncode == 2
+    assert f"no SQLite files match {tmp_path / pattern}" in result.stderr.decode()
+
+
+@pytest.mark.anyio
+async def test_enriched_catalog(get_session_generator):
+    statements = [
+        "create table author (id integer primary key, name text not null)",
+        "create table book (id integer primary key, author_id integer references author (id), title text, year int)",
+        "create index book_year on book (year)",
+        "insert into author values (1, 'Ann'), (2, 'Bob')",
+        "insert into book values (1, 1, 'First', 2001), (2, 1, 'Second', null), (3, 2, 'Third', 2003)",
+        "create view book_titles as select title from book",
+    ]
+    async for _, session in get_session_generator(statements, {}, extra_args=["--enriched-catalog", "--analyze"]):
+        # The plain catalog stays as it was
+        result = await session.call_tool("sqlite_get_catalog", {})
+        assert json.loads(result.content[0].text)["databases"]["main"]["tables"]["author"] == {
+            "columns": {"id": "", "name": ""}
+        }
+        result = await session.call_tool("sqlite_get_catalog", {"enriched": True})
+        tables = json.loads(result.content[0].text)["databases"]["main"]["tables"]
+        assert tables["book"] == {
+            "columns": {"id": "", "author_id": "", "title": "", "year": ""},
+            "column_types": {"id": "INTEGER", "author_id": "INTEGER", "title": "TEXT", "year": "INT"},
+            "primary_key": ["id"],
+            "foreign_keys": [{"columns": ["author_id"], "references_table": "author", "references_columns": ["id"]}],
+            "indexes": [{"name": "book_year", "unique": False, "columns": ["year"]}],
+            "estimated_rows": 3,
+            "sampled_rows": 3,
+            "column_statistics": {
+                "id": {"distinct": 3, "null_fraction": 0, "min": 1, "max": 3},
+                "author_id": {"distinct": 2, "null_fraction": 0, "min": 1, "max": 2},
+                "title": {"distinct": 3, "null_fraction": 0, "min": "First", "max": "Third"},
+                "year": {"distinct": 2, "null_fraction": 0.3333, "min": 2001, "max": 2003},
+            },
+        }
+        # Views are described but never sampled
+        assert tables["book_titles"] == {"columns": {"title": ""}, "column_types": {"title": "TEXT"}}
+        # Internal tables created by ANALYZE stay out of the catalog
+        assert "sqlite_stat1" not in tables
+
+
+@pytest.mark.anyio
+async def test_enriched_catalog_statistics_spread_over_table(get_session_generator):
+    statements = [
+        "create table events (id integer primary key, kind)",
+        "insert into events with recursive n(i) as (select 1 union all select i + 1 from n limit 20000) "
+        "select i, i % 3 from n",
+        "create table tags (name text primary key) without rowid",
+        "insert into tags values ('a'), ('b')",
+    ]
+    extra_args = ["--enriched-catalog", "--stats-sample-rows", "1000"]
+    async for _, session in get_session_generator(statements, {}, extra_args=extra_args):
+        result = await session.call_tool("sqlite_get_catalog", {"enriched": True})
+        tables = json.loads(result.content[0].text)["databases"]["main"]["tables"]
+        # 32 blocks of 32 rows each, from the start to the end of the table
+        assert tables["events"]["sampled_rows"] == 1024
+        assert tables["events"]["column_statistics"]["id"]["min"] == 1
+        assert tables["events"]["column_statistics"]["id"]["max"] > 19_000
+        assert tables["events"]["column_statistics"]["kind"]["distinct"] == 3
+        # Tables without rowids are read from the start
+        assert tables["tags"]["column_statistics"]["name"] == {
+            "distinct": 2,
+            "null_fraction": 0,
+            "min": "a",
+            "max": "b",
+        }
+
+
+@pytest.mark.anyio
+async def test_list_describe_and_search_tables(get_session_generator):
+    statements = [
+        "create table customer (id, full_name, email_address)",
+        "create table customer_order (id, customer_id, order_total)",
+        "create table shipment (id, order_id, carrier)",
+    ]
+    metadata = {
+        "databases": {
+            "_": {
+                "tables": {
+                    "shipment": {
+                        "description": "Parcels sent to customers",
+                        "columns": {"carrier": "Delivery company"},
+                    },
+                },
+            },
+        },
+    }
+    async for stem, session in get_session_generator(statements, metadata):
+        result = await session.call_tool("sqlite_list_tables", {})
+        assert json.loads(result.content[0].text) == {"main": ["customer", "customer_order", "shipment"]}
+        result = await session.call_tool("sqlite_describe_tables", {"tables": ["main.customer", "shipment"]})
+        assert json.loads(result.content[0].text) == {
+            "databases": {
+                "main": {
+                    "title": stem,
+                    "tables": {
+                        "customer": {"columns": {"id": "", "full_name": "", "email_address": ""}},
+                        "shipment": {
+                            "description": "Parcels sent to customers",
+                            "columns": {"id": "", "order_id": "", "carrier": "Delivery company"},
+                        },
+                    },
+                },
+            },
+        }
+        result = await session.call_tool("sqlite_describe_tables", {"tables": ["nonexistent"]})
+        assert result.isError
+        assert "Unknown tables: nonexistent" in result.content[0].text
+        # Misspelled words still match, and tables matching in more places rank higher
+        result = await session.call_tool("sqlite_search_catalog", {"query": "custmer"})
+        assert [match["table"] for match in json.loads(result.content[0].text)] == [
+            "customer_order",
+            "customer",
+            "shipment",
+        ]
+        result = await session.call_tool("sqlite_search_catalog", {"query": "deliver", "limit": 1})
+        assert json.loads(result.content[0].text) == [
+            {"database": "main", "table": "shipment", "score": 0.5, "matched_columns": ["carrier"]}
+        ]
+
+
+@pytest.mark.anyio
+async def test_catalog_from_snapshot(tmp_path):
+    db_file = tmp_path / "snapshot-db.db"
+    metadata_file = tmp_path / "metadata.yml"
+    snapshot_file = tmp_path / "snapshot.json"
+    async with aiosqlite.connect(db_file) as sqlite_connection:
+        await sqlite_connection.execute("create table table1 (col1)")
+        await sqlite_connection.commit()
+    metadata_file.write_text(yaml.dump({"databases": {"snapshot-db": {"queries": {"answer": {"sql": "select 42"}}}}}))
+    server_args = ["--directory", str(Path(__file__).parent.parent), "run", "mcp_sqlite/server.py", str(db_file)]
+    server_args += ["--metadata", str(metadata_file), "--snapshot", str(snapshot_file)]
+    compilation = await anyio.run_process(["uv", *server_args, "--compile-snapshot"])
+    assert compilation.returncode == 0
+    snapshot = json.loads(snapshot_file.read_text())
+    assert snapshot["metadata"] == {"databases": {"snapshot-db": {"queries": {"answer": {"sql": "select 42"}}}}}
+    assert json.loads(snapshot["catalog_json"])["databases"]["main"]["tables"] == {"table1": {"columns": {"col1": ""}}}
+    # Mark the catalog in the snapshot to tell whether the server used it rather than introspecting the file
+    catalog = json.loads(snapshot["catalog_json"])
+    catalog["databases"]["main"]["title"] = "From the snapshot"
+    snapshot["catalog_json"] = json.dumps(catalog)
+    snapshot_file.write_text(json.dumps(snapshot))
+
+    async def get_catalog():
+        async with stdio_client(StdioServerParameters(command="uv", args=server_args)) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                assert "answer" in [tool.name for tool in (await session.list_tools()).tools]
+                return json.loads((await session.call_tool("sqlite_get_catalog", {})).content[0].text)
+
+    assert (await get_catalog())["databases"]["main"]["title"] == "From the snapshot"
+    # Once the schema changes, the server introspects the file again
+    async with aiosqlite.connect(db_file) as sqlite_connection:
+        await sqlite_connection.execute("create table table2 (col2)")
+        await sqlite_connection.commit()
+    catalog = await get_catalog()
+    assert catalog["databases"]["main"]["title"] == "snapshot-db"
+    assert list(catalog["databases"]["main"]["tables"]) == ["table1", "table2"]
@@ -1,3 +1,8 @@
+import json
+from pathlib import Path
+
+import aiosqlite
+import anyio
 import pytest
 
 
@@ -69,3 +74,295 @@ async def test_execute_write_not_allowed_default(empty_tuple):
     _, empty_session = empty_tuple
     result = await empty_session.call_tool("sqlite_execute", {"sql": "create table tbl1 (col1, col2)"})
     assert result.content[0].text == "attempt to write a readonly database"
+
+
+@pytest.mark.anyio
+async def test_execute_truncates_rows(get_session_generator):
+    async for _, session in get_session_generator([], {}, extra_args=["--max-rows", "2"]):
+        result = await session.call_tool(
+            "sqlite_execute", {"sql": "with recursive n(i) as (select 1 union all select i + 1 from n) select i from n"}
+        )
+        table, notice = result.content[0].text.split("\n")
+        assert table == "<table><tr><th>i</th></tr><tr><td>1</td></tr><tr><td>2</td></tr></table>"
+        assert "truncated to the first 2 rows" in notice
+
+
+@pytest.mark.anyio
+async def test_execute_truncates_bytes(get_session_generator):
+    async for _, session in get_session_generator([], {}, extra_args=["--max-bytes", "60"]):
+        result = await session.call_tool("sqlite_execute", {"sql": "select 'x' as s union all select 'y'"})
+        table, notice = result.content[0].text.split("\n")
+        assert table == "<table><tr><th>s</th></tr><tr><td>x</td></tr></table>"
+        assert "60 bytes" in notice
+
+
+@pytest.mark.anyio
+async def test_execute_pagination(empty_tuple):
+    _, empty_session = empty_tuple
+    sql = "with recursive n(i) as (select 1 union all select i + 1 from n limit 5) select i from n"
+    result = await empty_session.call_tool("sqlite_execute", {"sql": sql, "page_size": 2})
+    table, notice = result.content[0].text.split("\n")
+    assert table == "<table><tr><th>i</th></tr><tr><td>1</td></tr><tr><td>2</td></tr></table>"
+    next_token = notice.split('"')[1]
+    result = await empty_session.call_tool("sqlite_execute", {"sql": sql, "page_size": 2, "next_token": next_token})
+    table, notice = result.content[0].text.split("\n")
+    assert table == "<table><tr><th>i</th></tr><tr><td>3</td></tr><tr><td>4</td></tr></table>"
+    # Each token can only be used once
+    result = await empty_session.call_tool("sqlite_execute", {"sql": sql, "page_size": 2, "next_token": next_token})
+    assert "Unknown or expired next_token" in result.content[0].text
+    next_token = notice.split('"')[1]
+    result = await empty_session.call_tool("sqlite_execute", {"sql": sql, "page_size": 2, "next_token": next_token})
+    assert result.content[0].text == "<table><tr><th>i</th></tr><tr><td>5</td></tr></table>"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("page_size", [0, -1])
+async def test_execute_pagination_rejects_empty_pages(empty_tuple, page_size):
+    _, empty_session = empty_tuple
+    result = await empty_session.call_tool("sqlite_execute", {"sql": "select 1", "page_size": page_size})
+    assert result.isError
+    assert result.content[0].text == f"page_size must be at least 1, got {page_size}."
+
+
+@pytest.mark.anyio
+async def test_execute_pagination_token_bound_to_query(empty_tuple):
+    _, empty_session = empty_tuple
+    result = await empty_session.call_tool("sqlite_execute", {"sql": "select 1 union all select 2", "page_size": 1})
+    next_token = result.content[0].text.split('"')[1]
+    result = await empty_session.call_tool("sqlite_execute", {"sql": "select 3", "next_token": next_token})
+    assert "different query" in result.content[0].text
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "result_format, expected",
+    [
+        ("csv", 'i,s\n1,"a,b"\n2,\n'),
+        ("jsonl", '{"i": 1, "s": "a,b"}\n{"i": 2, "s": null}\n'),
+        ("json", '{"columns":["i","s"],"rows":[[1,"a,b"],[2,null]]}'),
+        ("markdown", "| i | s |\n|---|---|\n| 1 | a,b |\n| 2 | None |\n"),
+    ],
+)
+async def test_execute_formats(empty_tuple, result_format, expected):
+    _, empty_session = empty_tuple
+    result = await empty_session.call_tool(
+        "sqlite_execute", {"sql": "select 1 as i, 'a,b' as s union all select 2, null", "format": result_format}
+    )
+    assert len(result.content) == 1
+    assert result.content[0].text == expected
+
+
+@pytest.mark.anyio
+async def test_execute_default_format(get_session_generator):
+    async for _, session in get_session_generator([], {}, extra_args=["--format", "json"]):
+        result = await session.call_tool("sqlite_execute", {"sql": "select 42 as i"})
+        assert result.content[0].text == '{"columns":["i"],"rows":[[42]]}'
+
+
+@pytest.mark.anyio
+async def test_execute_cached_result_invalidated_by_write(canned_tuple):
+    _, canned_session = canned_tuple
+    sql = "select count(*) as c from table4 where col4 = 777"
+    result = await canned_session.call_tool("custom_prefix_sqlite_execute", {"sql": sql})
+    assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>0</td></tr></table>"
+    await canned_session.call_tool("custom_prefix_write_succeeds", {"value": 777})
+    result = await canned_session.call_tool("custom_prefix_sqlite_execute", {"sql": sql})
+    assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>1</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_execute_cached_result_invalidated_by_external_write(get_session_generator):
+    async for _, session in get_session_generator(["create table t (x)"], {}):
+        sql = "select count(*) as c from t"
+        result = await session.call_tool("sqlite_execute", {"sql": sql})
+        assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>0</td></tr></table>"
+        database_list = await session.call_tool("sqlite_execute", {"sql": "pragma database_list", "format": "json"})
+        db_file = json.loads(database_list.content[0].text)["rows"][0][2]
+        async with aiosqlite.connect(db_file) as sqlite_connection:
+            await sqlite_connection.execute("insert into t values (1)")
+            await sqlite_connection.commit()
+        result = await session.call_tool("sqlite_execute", {"sql": sql})
+        assert result.content[0].text == "<table><tr><th>c</th></tr><tr><td>1</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_execute_cached_result_keeps_literal_whitespace(empty_tuple):
+    _, empty_session = empty_tuple
+    for literal in ["a  b", "a b", "a  b"]:
+        result = await empty_session.call_tool("sqlite_execute", {"sql": f"select '{literal}' as s", "format": "json"})
+        assert json.loads(result.content[0].text)["rows"] == [[literal]]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "expression", ["current_timestamp", "current_date", "current_time", "date()", "datetime()", "CURRENT_TIMESTAMP"]
+)
+async def test_execute_current_time_not_cached(get_session_generator, expression):
+    async for _, session in get_session_generator([], {}):
+        for _ in range(2):
+            await session.call_tool("sqlite_execute", {"sql": f"select {expression} as now"})
+        stats = json.loads((await session.call_tool("sqlite_stats", {})).content[0].text)
+        assert stats["tools"]["sqlite_execute"]["cache_hits"] == 0
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "extra_args, reason",
+    [
+        (["--query-timeout", "0.5"], "longer than the limit of 0.5 seconds"),
+        (["--max-steps", "100000"], "more than the limit of 100000 steps"),
+    ],
+)
+async def test_execute_runaway_query_interrupted(get_session_generator, extra_args, reason):
+    async for _, session in get_session_generator([], {}, extra_args=extra_args):
+        runaway_sql = "with recursive n(i) as (select 1 union all select i + 1 from n) select count(*) from n"
+        result = await session.call_tool("sqlite_execute", {"sql": runaway_sql})
+        assert result.content[0].text == f"Query interrupted because it ran {reason}."
+        # The connection is usable again afterwards
+        result = await session.call_tool("sqlite_execute", {"sql": "select 42 as i"})
+        assert result.content[0].text == "<table><tr><th>i</th></tr><tr><td>42</td></tr></table>"
+
+
+@pytest.mark.anyio
+async def test_execute_rejected_when_queue_full(get_session_generator):
+    async for _, session in get_session_generator([], {}, extra_args=["--pool-size", "1", "--max-queued", "1"]):
+        results = {}
+
+        async def call_slow_query(index):
+            sql = f"with recursive n(i) as (select 1 union all select i + 1 from n limit {3_000_000 + index}) "
+            sql += "select count(*) > 0 as done from n"
+            results[index] = await session.call_tool("sqlite_execute", {"sql": sql})
+
+        async with anyio.create_task_group() as task_group:
+            for index in range(3):
+                task_group.start_soon(call_slow_query, index)
+        texts = [result.content[0].text for result in results.values()]
+        assert texts.count("<table><tr><th>done</th></tr><tr><td>1</td></tr></table>") == 2
+        assert len([text for text in texts if "server is busy" in text]) == 1
+
+
+@pytest.mark.anyio
+async def test_execute_reader_pragmas(get_session_generator):
+    extra_args = ["--mmap-size", "1048576", "--cache-size", "4096", "--temp-store-memory", "--query-only"]
+    async for _, session in get_session_generator([], {}, extra_args=extra_args + ["--immutable", "--warm-up"]):
+        for pragma, value in [("mmap_size", "1048576"), ("cache_size", "-4096"), ("temp_store", "2")]:
+            result = await session.call_tool("sqlite_execute", {"sql": f"pragma {pragma}", "format": "csv"})
+            assert result.content[0].text == f"{pragma}\n{value}\n"
+        result = await session.call_tool("sqlite_execute", {"sql": "create temp table scratch (col1)"})
+        assert result.isError
+
+
+@pytest.mark.anyio
+async def test_execute_cannot_change_pooled_connections(get_session_generator):
+    async for _, session in get_session_generator(["create table t (x)"], {}, extra_args=["--pool-size", "1"]):
+        for sql in [
+            "create temp table scratch (col1)",
+            "create view temp.scratch_view as select 1",
+            "attach database ':memory:' as m2",
+            "pragma query_only = 1",
+        ]:
+            result = await session.call_tool("sqlite_execute", {"sql": sql})
+            assert result.isError
+            assert result.content[0].text == "not authorized"
+        # The next call on the same connection sees none of it, while pragmas that only read still work
+        result = await session.call_tool("sqlite_execute", {"sql": "pragma database_list", "format": "json"})
+        assert [row[1] for row in json.loads(result.content[0].text)["rows"]] == ["main"]
+        result = await session.call_tool("sqlite_execute", {"sql": "select name from pragma_table_info('t')"})
+        assert result.content[0].text == "<table><tr><th>name</th></tr><tr><td>x</td></tr></table>"
+        result = await session.call_tool("sqlite_execute", {"sql": "pragma query_only", "format": "csv"})
+        assert result.content[0].text == "query_only\n0\n"
+        catalog = json.loads((await session.call_tool("sqlite_get_catalog", {})).content[0].text)
+        assert list(catalog["databases"]) == ["main"]
+
+
+@pytest.mark.anyio
+async def test_immutable_rejects_canned_writes(get_session_generator):
+    metadata = {"databases": {"_": {"queries": {"wipe": {"sql": "delete from table1", "write": True}}}}}
+    with pytest.raises(ExceptionGroup):
+        async for _ in get_session_generator(["create table table1 (col1)"], metadata, extra_args=["--immutable"]):
+            pass
+
+
+@pytest.mark.anyio
+async def test_execute_sampled(get_session_generator):
+    statements = [
+        "create table events (id integer primary key, kind)",
+        "insert into events with recursive n(i) as (select 1 union all select i + 1 from n limit 10000) "
+        "select i, i % 2 from n",
+        "create table events_sample as select * from events where id % 100 = 0",
+        "create table logs (id integer primary key, level)",
+        "insert into logs select id, 'info' from events",
+    ]
+    tables = {"events": {"sample_fraction": 0.01, "sample_table": "events_sample"}, "logs": {"sample_fraction": 0.1}}
+    async for _, session in get_session_generator(statements, {"databases": {"_": {"tables": tables}}}):
+        tools = await session.list_tools()
+        execute_tool = next(tool for tool in tools.tools if tool.name == "sqlite_execute")
+        assert "sample" in execute_tool.inputSchema["properties"]
+        result = await session.call_tool(
+            "sqlite_execute", {"sql": "select count(*) as c from events as e where e.kind = 0", "sample": True}
+        )
+        assert result.content[0].text.startswith("<table><tr><th>c</th></tr><tr><td>100</td></tr></table>\nSampled:")
+        assert "multiplied by 100" in result.content[0].text
+        result = await session.call_tool(
+            "sqlite_execute", {"sql": "select count(*) as c from logs", "sample": True, "format": "csv"}
+        )
+        count = int(result.content[0].text.split("\n")[1])
+        assert 900 <= count <= 1100
+        assert "32 evenly spread ranges of its rowids" in result.content[0].text
+        result = await session.call_tool("sqlite_execute", {"sql": "select count(*) as c from events", "format": "csv"})
+        assert result.content[0].text == "c\n10000\n"
+        result = await session.call_tool("sqlite_execute", {"sql": "select 42", "sample": True})
+        assert result.isError
+        assert "events, logs" in result.content[0].text
+        # Tables listed after commas and qualified with their database are sampled too
+        sql = "select count(main.events.id) as c from events_sample as s, main.events where main.events.id = s.id"
+        result = await session.call_tool("sqlite_execute", {"sql": sql, "sample": True, "format": "csv"})
+        assert result.content[0].text.startswith("c\n100\n")
+        # Unaliased columns keep their names
+        sql = "select (select count(*) from events), max(logs.id) > 0 from logs"
+        result = await session.call_tool("sqlite_execute", {"sql": sql, "sample": True, "format": "json"})
+        assert json.loads(result.content[0].text.split("\n")[0]) == {
+            "columns": ["(select count(*) from events)", "max(logs.id) > 0"],
+            "rows": [[100, 1]],
+        }
+        # Tables named only in literals and comments are neither sampled nor rewritten
+        sql = "select count(*) as c, 'from events' as s from events -- join events\nwhere kind = 0"
+        result = await session.call_tool("sqlite_execute", {"sql": sql, "sample": True, "format": "csv"})
+        assert result.content[0].text.startswith("c,s\n100,from events\n")
+        result = await session.call_tool(
+            "sqlite_execute", {"sql": "select 'from logs' /* join events */", "sample": True}
+        )
+        assert result.isError
+        assert "events, logs" in result.content[0].text
+
+
+@pytest.mark.anyio
+async def test_export(get_session_generator, tmp_path):
+    statements = [
+        "create table numbers (n, label)",
+        "insert into numbers with recursive n(i) as (select 1 union all select i + 1 from n limit 10000) "
+        "select i, 'number ' || i from n",
+    ]
+    async for _, session in get_session_generator(statements, {}, extra_args=["--export-dir", str(tmp_path)]):
+        result = await session.call_tool("sqlite_export", {"sql": "select n, label from numbers order by n"})
+        summary = json.loads(result.content[0].text)
+        export_file = Path(summary["uri"].removeprefix("file://"))
+        assert export_file.parent == tmp_path and export_file.suffix == ".csv"
+        assert summary["rows"] == 10000
+        assert summary["columns"] == ["n", "label"]
+        assert summary["sample_rows"] == [
+            [1, "number 1"],
+            [2, "number 2"],
+            [3, "number 3"],
+            [4, "number 4"],
+            [5, "number 5"],
+        ]
+        lines = export_file.read_text().splitlines()
+        assert lines[:2] == ["n,label", "1,number 1"] and lines[-1] == "10000,number 10000" and len(lines) == 10001
+        assert summary["bytes"] == export_file.stat().st_size
+        result = await session.call_tool(
+            "sqlite_export", {"sql": "select n from numbers where n <= 2", "format": "json"}
+        )
+        export_file = Path(json.loads(result.content[0].text)["uri"].removeprefix("file://"))
+        assert json.loads(export_file.read_text()) == {"columns": ["n"], "rows": [[1], [2]]}
+        assert sorted(path.suffix for path in tmp_path.iterdir()) == [".csv", ".json"]
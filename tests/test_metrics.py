@@ -0,0 +1,41 @@
+import json
+
+import anyio
+import pytest
+
+
+@pytest.mark.anyio
+async def test_stats_and_slow_query_log(get_session_generator, tmp_path):
+    metrics_file = tmp_path / "metrics.prom"
+    statements = ["create table table1 (col1)", "insert into table1 values (1), (2), (3)"]
+    extra_args = ["--slow-query-seconds", "1e-9", "--metrics-file", str(metrics_file), "--metrics-interval", "0.1"]
+    async for _, session in get_session_generator(statements, {}, extra_args=extra_args):
+        sql = "select col1 from table1 where col1 > 1"
+        await session.call_tool("sqlite_execute", {"sql": sql})
+        await session.call_tool("sqlite_execute", {"sql": sql})
+        await session.call_tool("sqlite_execute", {"sql": "select nonexistent"})
+        # Slow queries are explained in the background, so give them a moment to land in the log
+        for _ in range(50):
+            stats = json.loads((await session.call_tool("sqlite_stats", {})).content[0].text)
+            if stats["slow_query_count"]:
+                break
+            await anyio.sleep(0.1)
+        execute_stats = stats["tools"]["sqlite_execute"]
+        assert execute_stats["calls"] == 3
+        assert execute_stats["errors"] == 1
+        assert execute_stats["rows"] == 2
+        assert execute_stats["cache_hits"] == 1
+        assert sum(execute_stats["latency_buckets"].values()) == 3
+        assert stats["result_cache"]["hits"] == 1
+        assert set(stats["queue"]["wait_seconds"]) == {"read", "write"}
+        slow_query = stats["slow_queries"][0]
+        assert slow_query["tool"] == "sqlite_execute"
+        assert slow_query["sql"] == sql
+        assert any("SCAN table1" in detail for detail in slow_query["query_plan"])
+        for _ in range(50):
+            if metrics_file.exists():
+                break
+            await anyio.sleep(0.1)
+        metrics_text = metrics_file.read_text()
+        assert "# TYPE mcp_sqlite_tool_latency_seconds histogram" in metrics_text
+        assert 'mcp_sqlite_tool_latency_seconds_count{tool="sqlite_execute"}' in metrics_text
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+STATEMENTS = [
+    "create table orders (id integer primary key, customer_id, total)",
+    "with recursive n(i) as (select 1 union all select i + 1 from n where i < 200) "
+    "insert into orders select i, i % 10, i from n",
+    "create table small (a)",
+]
+
+
+@pytest.mark.anyio
+async def test_explain_query_suggests_index(get_session_generator):
+    async for _, session in get_session_generator(STATEMENTS, {}, extra_args=["--large-table-rows", "100"]):
+        result = await session.call_tool(
+            "sqlite_explain_query", {"sql": "select total from orders as o where o.customer_id = 3"}
+        )
+        analysis = json.loads(result.content[0].text)
+        assert analysis["plan"] == ["SCAN o"]
+        assert analysis["large_table_scans"] == [
+            {"database": "main", "table": "orders", "estimated_rows": 200, "detail": "SCAN o"}
+        ]
+        [suggestion] = analysis["suggested_indexes"]
+        assert suggestion["sql"] == (
+            'create index "orders_customer_id_total_index" on "orders" ("customer_id", "total")'
+        )
+        assert suggestion["plan_with_index"] == [
+            "SEARCH o USING COVERING INDEX orders_customer_id_total_index (customer_id=?)"
+        ]
+        # Small tables are cheap to scan
+        result = await session.call_tool("sqlite_explain_query", {"sql": "select * from small where a = 1"})
+        assert json.loads(result.content[0].text)["large_table_scans"] == []
+
+
+@pytest.mark.anyio
+async def test_scan_warnings_and_recorded_scans(get_session_generator):
+    extra_args = ["--large-table-rows", "100", "--scan-warnings", "--record-scans"]
+    async for _, session in get_session_generator(STATEMENTS, {}, extra_args=extra_args):
+        for customer_id in range(3):
+            result = await session.call_tool(
+                "sqlite_execute", {"sql": f"select count(*) from orders where customer_id = {customer_id}"}
+            )
+            assert "Note: this query reads every row of orders (about 200 rows)." in result.content[0].text
+        # Repeating a query returns its cached result along with the note, and isn't recorded again
+        result = await session.call_tool("sqlite_execute", {"sql": "select count(*) from orders where customer_id = 0"})
+        assert "Note: this query reads every row of orders (about 200 rows)." in result.content[0].text
+        result = await session.call_tool("sqlite_execute", {"sql": "select * from orders where id = 1"})
+        assert "Note" not in result.content[0].text
+        stats = json.loads((await session.call_tool("sqlite_stats", {})).content[0].text)
+        assert stats["scan_patterns"] == [
+            {
+                "database": "main",
+                "table": "orders",
+                "suggested_index": 'create index "orders_customer_id_index" on "orders" ("customer_id")',
+                "count": 3,
+                "example_sql": "select count(*) from orders where customer_id = 0",
+                "estimated_rows": 200,
+            }
+        ]
+
+
+@pytest.mark.anyio
+async def test_explain_query_leaves_out_indexes_the_plan_wouldnt_use(get_session_generator):
+    statements = STATEMENTS + ["create table customers (id integer primary key, name)"]
+    async for _, session in get_session_generator(statements, {}, extra_args=["--large-table-rows", "100"]):
+        sql = "select name, total from orders join customers on customers.id = orders.customer_id"
+        result = await session.call_tool("sqlite_explain_query", {"sql": sql})
+        analysis = json.loads(result.content[0].text)
+        assert analysis["suggested_indexes"] == []
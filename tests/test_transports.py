@@ -0,0 +1,19 @@
+import anyio
+import pytest
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("transport", ["http", "sse"])
+async def test_http_transport_serves_concurrent_sessions(get_http_server_generator, transport):
+    async for open_session in get_http_server_generator(["create table table1 (col1)"], transport):
+        results = {}
+
+        async def call_in_new_session(index):
+            async with open_session() as session:
+                results[index] = await session.call_tool("sqlite_execute", {"sql": f"select {index} as i"})
+
+        async with anyio.create_task_group() as task_group:
+            for index in range(3):
+                task_group.start_soon(call_in_new_session, index)
+        for index in range(3):
+            assert results[index].content[0].text == f"<table><tr><th>i</th></tr><tr><td>{index}</td></tr></table>"